@@ -3,7 +3,7 @@
 # --- Phần import của file alns/destroy_operators.py ---
 
 import random
-from typing import List, Tuple, TYPE_CHECKING, Set
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING, Set
 import config
 
 # Import từ cùng package 'alns'
@@ -16,7 +16,6 @@ if TYPE_CHECKING:
     from core.data_structures import Solution, SERoute, FERoute
     from core.problem_parser import ProblemInstance, Customer
 
-# (Hàm _perform_removal giữ nguyên)
 def _perform_removal(solution: "Solution", context: "ChangeContext", to_remove_ids: Set[int]) -> List["Customer"]:
     removed_objs = []
     affected_fes = set()
@@ -28,22 +27,21 @@ def _perform_removal(solution: "Solution", context: "ChangeContext", to_remove_i
         context.backup_route(fe_route)
         for se_route in fe_route.serviced_se_routes:
             context.backup_route(se_route)
+    # <<< GOM CÁC KHÁCH HÀNG CẦN XÓA THEO TUYẾN, MỖI TUYẾN XÓA MỘT LẦN (SERoute.remove_customers) >>>
+    removals_by_route: Dict["SERoute", Set[int]] = {}
     for cust_id in to_remove_ids:
         if cust_id in cust_map_snapshot:
-            se_route = cust_map_snapshot[cust_id]
-            customer_obj = solution.problem.node_objects[cust_id]
-            removed_objs.append(customer_obj)
-            se_route.remove_customer(customer_obj)
-    solution.update_customer_map()
+            removals_by_route.setdefault(cust_map_snapshot[cust_id], set()).add(cust_id)
+            removed_objs.append(solution.problem.node_objects[cust_id])
+    for se_route, cust_ids in removals_by_route.items():
+        solution.remove_customers(se_route, cust_ids)
     for fe_route in affected_fes:
         for se_route_in_fe in list(fe_route.serviced_se_routes):
             if not se_route_in_fe.get_customers():
                 solution.unlink_routes(fe_route, se_route_in_fe)
                 solution.remove_se_route(se_route_in_fe)
-                context.track_removed_route(se_route_in_fe)
         if not fe_route.serviced_se_routes:
              solution.remove_fe_route(fe_route)
-             context.track_removed_route(fe_route)
         else:
              _recalculate_fe_route_and_check_feasibility(fe_route, solution.problem)
     return removed_objs
@@ -62,10 +60,10 @@ def _calculate_relatedness(cust1: "Customer", cust2: "Customer", solution: "Solu
     norm_dist = dist / problem._max_dist if problem._max_dist > 0 else 0
     se_route1 = solution.customer_to_se_route_map.get(cust1.id); se_route2 = solution.customer_to_se_route_map.get(cust2.id)
     if not se_route1 or not se_route2: return float('inf')
-    start_time1 = se_route1.service_start_times.get(cust1.id, 0.0); start_time2 = se_route2.service_start_times.get(cust2.id, 0.0)
+    start_time1 = se_route1.get_service_start_time(cust1.id, 0.0); start_time2 = se_route2.get_service_start_time(cust2.id, 0.0)
     time_diff = abs(start_time1 - start_time2)
     norm_time = time_diff / problem._max_due_time if problem._max_due_time > 0 else 0
-    demand_diff = abs(cust1.demand - cust2.demand)
+    demand_diff = abs(problem.node_demand[cust1.id] - problem.node_demand[cust2.id])
     norm_demand = demand_diff / problem._max_demand if problem._max_demand > 0 else 0
     same_route_flag = 0 if se_route1 is se_route2 else 1
     return (W_DIST * norm_dist + W_TIME * norm_time + W_DEMAND * norm_demand + W_ROUTE * same_route_flag)
@@ -78,7 +76,9 @@ def shaw_removal(solution: "Solution", context: "ChangeContext", q: int, p: int
     while len(to_remove_ids) < q:
         bait_id = random.choice(list(to_remove_ids)); bait_obj = solution.problem.node_objects[bait_id]
         unselected_cust_ids = [cid for cid in all_served_cust_ids if cid not in to_remove_ids]
-        candidates = sorted([(cid, _calculate_relatedness(bait_obj, solution.problem.node_objects[cid], solution)) for cid in unselected_cust_ids], key=lambda x: x[1])
+        # Khách hàng không thể đứng trước hay sau bait trong cùng một tuyến (theo cửa sổ thời gian) bị xếp cuối.
+        tw_mask = solution.problem.tw_succ_mask[bait_id] | solution.problem.tw_pred_mask[bait_id]
+        candidates = sorted([(cid, (tw_mask >> cid) & 1 == 0, _calculate_relatedness(bait_obj, solution.problem.node_objects[cid], solution)) for cid in unselected_cust_ids], key=lambda x: (x[1], x[2]))
         index = int(pow(random.random(), p) * len(candidates))
         to_remove_ids.add(candidates[index][0])
     return _perform_removal(solution, context, to_remove_ids)
@@ -86,7 +86,8 @@ def shaw_removal(solution: "Solution", context: "ChangeContext", q: int, p: int
 def worst_slack_removal(solution: "Solution", context: "ChangeContext", q: int, p: int = 3) -> List["Customer"]:
     candidates = []
     for cust_id, se_route in solution.customer_to_se_route_map.items():
-        candidates.append((cust_id, se_route.forward_time_slacks.get(cust_id, 0.0)))
+        if cust_id not in se_route.nodes_id: continue
+        candidates.append((cust_id, se_route.forward_time_slacks[se_route.nodes_id.index(cust_id)]))
     if not candidates: return []
     candidates.sort(key=lambda x: x[1])
     to_remove_ids = set(); q = min(q, len(candidates))
@@ -95,32 +96,49 @@ def worst_slack_removal(solution: "Solution", context: "ChangeContext", q: int,
         to_remove_ids.add(candidates.pop(index)[0])
     return _perform_removal(solution, context, to_remove_ids)
 
+def _calculate_removal_gain(se_route: "SERoute", pos: int, problem: "ProblemInstance") -> Optional[float]:
+    """
+    Mức giảm chính xác của hàm mục tiêu khi xóa khách hàng ở vị trí pos của se_route, tính trong O(1)
+    từ lịch trình hiện tại (SERoute.evaluate_removal): phần tuyến SE, cộng chi phí xe SE nếu tuyến chỉ còn
+    khách hàng này, cùng phần tuyến FE không còn phải ghé vệ tinh (hoặc cả tuyến FE và chi phí xe FE)
+    theo thứ tự vệ tinh hiện tại; việc sắp lại thứ tự FE sau khi xóa có thể tiết kiệm thêm.
+    Trả về None nếu việc xóa làm lịch trình tuyến SE không hợp lệ.
+    """
+    se_gain = se_route.evaluate_removal(pos)
+    if se_gain is None: return None
+    use_dist = config.PRIMARY_OBJECTIVE == "DISTANCE"
+    primary_gain = se_gain[0] if use_dist else se_gain[1]
+    vehicle_gain = 0.0
+    if len(se_route.nodes_id) == 3 and se_route.serving_fe_routes:
+        if config.OPTIMIZE_VEHICLE_COUNT: vehicle_gain += config.WEIGHT_SE_VEHICLE
+        fe_route = next(iter(se_route.serving_fe_routes))
+        sat_id = se_route.satellite.id
+        if len(fe_route.serviced_se_routes) == 1:
+            primary_gain += fe_route.total_dist if use_dist else fe_route.total_travel_time
+            if config.OPTIMIZE_VEHICLE_COUNT: vehicle_gain += config.WEIGHT_FE_VEHICLE
+        elif len(fe_route.se_routes_by_sat[sat_id]) == 1:
+            cost_rows = problem.dist_rows if use_dist else problem.time_rows
+            path = fe_route.path
+            i = path.index(sat_id)
+            primary_gain += cost_rows[path[i-1]][sat_id] + cost_rows[sat_id][path[i+1]] - cost_rows[path[i-1]][path[i+1]]
+    return config.WEIGHT_PRIMARY * primary_gain + vehicle_gain
+
 # <<< HÀM NÀY ĐƯỢC CẬP NHẬT >>>
 def worst_cost_removal(solution: "Solution", context: "ChangeContext", q: int, p: int = 3) -> List["Customer"]:
     """
-    Xóa các khách hàng có chi phí tiết kiệm được (cost saving) cao nhất, dựa trên
-    hàm mục tiêu chính (DISTANCE hoặc TRAVEL_TIME) được cấu hình.
+    Xóa các khách hàng có mức giảm hàm mục tiêu khi bị xóa cao nhất (xem _calculate_removal_gain:
+    chi phí di chuyển chính theo config, kèm chi phí xe và phần tuyến FE được tiết kiệm).
     """
     problem = solution.problem
     candidates = []
-    
-    # Xác định hàm chi phí dựa trên config
-    cost_func = problem.get_distance if config.PRIMARY_OBJECTIVE == "DISTANCE" else problem.get_travel_time
 
     for cust_id, se_route in solution.customer_to_se_route_map.items():
         if cust_id not in se_route.nodes_id: continue
         pos = se_route.nodes_id.index(cust_id)
         if pos == 0 or pos == len(se_route.nodes_id) - 1: continue
-            
-        prev_node_id = se_route.nodes_id[pos - 1]
-        next_node_id = se_route.nodes_id[pos + 1]
-        
-        cost_prev_cust = cost_func(prev_node_id % problem.total_nodes, cust_id)
-        cost_cust_next = cost_func(cust_id, next_node_id % problem.total_nodes)
-        cost_prev_next = cost_func(prev_node_id % problem.total_nodes, next_node_id % problem.total_nodes)
-        
-        cost_saving = cost_prev_cust + cost_cust_next - cost_prev_next
-        candidates.append((cust_id, cost_saving))
+        removal_gain = _calculate_removal_gain(se_route, pos, problem)
+        if removal_gain is None: continue
+        candidates.append((cust_id, removal_gain))
 
     if not candidates: return []
 
@@ -5,12 +5,13 @@
 import copy
 import heapq
 import itertools
-from typing import Dict, Optional, List, Tuple, TYPE_CHECKING
+from typing import Callable, Dict, Optional, List, Tuple, TYPE_CHECKING
 
 import config
 # Import từ package 'core'
 from core.data_structures import SERoute, FERoute, Solution
-from core.problem_parser import Customer
+from core.transaction import ChangeContext
+from core.problem_parser import Customer, KIND_DELIVERY
 
 if TYPE_CHECKING:
     from core.problem_parser import ProblemInstance, Satellite
@@ -23,154 +24,247 @@ class InsertionProcessor:
     def find_all_feasible_insertions_for_se_route(self, route: SERoute, customer: "Customer") -> List[Dict]:
         feasible_options = []
         problem = route.problem
-        for i in range(len(route.nodes_id) - 1):
-            pos_to_insert = i + 1
-            temp_nodes_id = route.nodes_id[:pos_to_insert] + [customer.id] + route.nodes_id[pos_to_insert:]
-            new_delivery_load = route.total_load_delivery
-            if customer.type == 'DeliveryCustomer': new_delivery_load += customer.demand
-            if new_delivery_load > problem.se_vehicle_capacity + 1e-6: break 
-            running_load = new_delivery_load; is_load_feasible = True
-            for node_id in temp_nodes_id[1:-1]:
-                cust_obj = problem.node_objects[node_id]
-                if cust_obj.type == 'DeliveryCustomer': running_load -= cust_obj.demand
-                else: running_load += cust_obj.demand
-                if running_load < -1e-6 or running_load > problem.se_vehicle_capacity + 1e-6:
-                    is_load_feasible = False; break
-            if not is_load_feasible: continue
-            prev_node_id = route.nodes_id[pos_to_insert - 1]; next_node_id = route.nodes_id[pos_to_insert]
-            prev_obj = problem.node_objects[prev_node_id % problem.total_nodes]; next_obj = problem.node_objects[next_node_id % problem.total_nodes]
-            dist_increase = (problem.get_distance(prev_obj.id, customer.id) + problem.get_distance(customer.id, next_obj.id) - problem.get_distance(prev_obj.id, next_obj.id))
-            time_increase = (problem.get_travel_time(prev_obj.id, customer.id) + problem.get_travel_time(customer.id, next_obj.id) - problem.get_travel_time(prev_obj.id, next_obj.id))
+        phys, dist_rows, time_rows, cid = problem.route_node_phys, problem.dist_rows, problem.time_rows, customer.id
+        # <<< LOẠI SỚM THEO CỬA SỔ THỜI GIAN (TIỀN XỬ LÝ) TRƯỚC KHI KIỂM TRA TẢI / TÍNH CHI PHÍ >>>
+        if not (problem.sat_serve_mask[route.satellite.id] >> cid) & 1: return feasible_options
+        pred_mask, succ_mask = problem.tw_pred_mask[cid], problem.tw_succ_mask[cid]
+        if problem.node_kind[cid] == KIND_DELIVERY and route.total_load_delivery + problem.node_demand[cid] > problem.se_vehicle_capacity + 1e-6:
+            return feasible_options
+        nodes_id, can_insert_load = route.nodes_id, route.can_insert_load
+        for pos_to_insert in range(1, len(nodes_id)):
+            prev_phys = phys[nodes_id[pos_to_insert - 1]]; next_phys = phys[nodes_id[pos_to_insert]]
+            if not ((pred_mask >> prev_phys) & 1 and (succ_mask >> next_phys) & 1): continue
+            # <<< KIỂM TRA TẢI TRỌNG O(1) BẰNG PROFILE TẢI TIỀN TỐ / HẬU TỐ CỦA TUYẾN >>>
+            if not can_insert_load(cid, pos_to_insert): continue
+            dist_increase = dist_rows[prev_phys][cid] + dist_rows[cid][next_phys] - dist_rows[prev_phys][next_phys]
+            time_increase = time_rows[prev_phys][cid] + time_rows[cid][next_phys] - time_rows[prev_phys][next_phys]
             feasible_options.append({"pos": pos_to_insert, "dist_increase": dist_increase, "time_increase": time_increase})
         return feasible_options
 
-# <<< HÀM NÀY ĐÃ ĐƯỢỢC SỬA LỖI >>>
+    def evaluate_insertion(self, se_route: SERoute, customer: "Customer", pos: int) -> Tuple[bool, float, float, float]:
+        """
+        Đánh giá thuần việc chèn customer vào vị trí pos của se_route: KHÔNG thay đổi tuyến SE hay tuyến FE phục vụ nó,
+        chỉ đọc lịch trình / profile cache của chúng (SERoute.departure_profile_with_insertion, FERoute.evaluate_sat_change).
+        Trả về (khả thi, Δ quãng đường, Δ thời gian di chuyển, thời điểm xe FE về depot mới); Δ gồm cả tuyến SE và tuyến FE
+        (thứ tự vệ tinh có thể đổi).
+        """
+        problem = self.problem
+        cid = customer.id
+        if not se_route.serving_fe_routes or not se_route.can_insert_load(cid, pos): return False, 0.0, 0.0, float('inf')
+        fe_route = next(iter(se_route.serving_fe_routes))
+        phys, dist_rows, time_rows = problem.route_node_phys, problem.dist_rows, problem.time_rows
+        prev_phys, next_phys = phys[se_route.nodes_id[pos - 1]], phys[se_route.nodes_id[pos]]
+        se_dist = dist_rows[prev_phys][cid] + dist_rows[cid][next_phys] - dist_rows[prev_phys][next_phys]
+        se_time = time_rows[prev_phys][cid] + time_rows[cid][next_phys] - time_rows[prev_phys][next_phys]
+        demand = problem.node_demand[cid]
+        delivery, pickup = (demand, 0.0) if problem.node_kind[cid] == KIND_DELIVERY else (0.0, demand)
+        feasible, fe_dist, fe_time, fe_arrival = fe_route.evaluate_sat_change(
+            se_route.satellite.id, se_route, se_route.departure_profile_with_insertion(cid, pos), delivery, pickup)
+        if not feasible: return False, 0.0, 0.0, float('inf')
+        return True, se_dist + fe_dist - fe_route.total_dist, se_time + fe_time - fe_route.total_travel_time, fe_arrival
+
 def _recalculate_fe_route_and_check_feasibility(fe_route: FERoute, problem: "ProblemInstance") -> Tuple[bool, Optional[float], Optional[float]]:
-    if not fe_route.serviced_se_routes:
-        fe_route.total_dist = 0.0
-        fe_route.schedule = []
-        fe_route.calculate_route_properties()
-        return True, 0.0, 0.0
-        
-    depot = problem.depot
-    
-    # <<< BƯỚC 1: TÍNH TẢI TRỌNG BAN ĐẦU >>>
-    initial_delivery_load = sum(se.total_load_delivery for se in fe_route.serviced_se_routes)
-    
-    # <<< BƯỚC 2: KIỂM TRA TẢI TRỌNG NGAY LẬP TỨC >>>
-    if initial_delivery_load > problem.fe_vehicle_capacity + 1e-6:
-        return False, None, None # Báo cáo không khả thi ngay lập tức
-
-    sats_to_visit = {se.satellite for se in fe_route.serviced_se_routes}
-    sats_list = sorted(list(sats_to_visit), key=lambda s: problem.get_distance(depot.id, s.id))
-    
-    schedule = []
-    current_time = 0.0
-    current_load = initial_delivery_load # Sử dụng lại giá trị đã tính
-    
-    schedule.append({'activity': 'DEPART_DEPOT', 'node_id': depot.id, 'load_change': current_load, 'load_after': current_load, 'arrival_time': 0.0, 'start_svc_time': 0.0, 'departure_time': 0.0})
-    
-    last_node_id = depot.id
-    route_deadlines = set()
-
-    for satellite in sats_list:
-        arrival_at_sat = current_time + problem.get_travel_time(last_node_id, satellite.id)
-        se_routes_at_sat = [r for r in fe_route.serviced_se_routes if r.satellite == satellite]
-        del_load_at_sat = sum(r.total_load_delivery for r in se_routes_at_sat)
-        current_load -= del_load_at_sat
-        schedule.append({'activity': 'UNLOAD_DELIV', 'node_id': satellite.id, 'load_change': -del_load_at_sat, 'load_after': current_load, 'arrival_time': arrival_at_sat, 'start_svc_time': arrival_at_sat, 'departure_time': arrival_at_sat})
-        latest_se_finish = 0
-        for se_route in se_routes_at_sat:
-            se_route.service_start_times[se_route.nodes_id[0]] = arrival_at_sat
-            se_route.calculate_full_schedule_and_slacks()
-            for cust in se_route.get_customers():
-                if hasattr(cust, 'due_time') and se_route.service_start_times.get(cust.id, float('inf')) > cust.due_time + 1e-6:
-                    return False, None, None
-                if hasattr(cust, 'deadline'): route_deadlines.add(cust.deadline)
-            latest_se_finish = max(latest_se_finish, se_route.service_start_times.get(se_route.nodes_id[-1], 0))
-        pickup_load_at_sat = sum(r.total_load_pickup for r in se_routes_at_sat)
-        departure_from_sat = latest_se_finish
-        current_load += pickup_load_at_sat
-        schedule.append({'activity': 'LOAD_PICKUP', 'node_id': satellite.id, 'load_change': pickup_load_at_sat, 'load_after': current_load, 'arrival_time': latest_se_finish, 'start_svc_time': latest_se_finish, 'departure_time': departure_from_sat})
-        current_time = departure_from_sat
-        last_node_id = satellite.id
-
-    arrival_at_depot = current_time + problem.get_travel_time(last_node_id, depot.id)
-    schedule.append({'activity': 'ARRIVE_DEPOT', 'node_id': depot.id, 'load_change': -current_load, 'load_after': 0, 'arrival_time': arrival_at_depot, 'start_svc_time': arrival_at_depot, 'departure_time': arrival_at_depot})
-    
-    fe_route.schedule = schedule
-    fe_route.calculate_route_properties()
-    
-    effective_deadline = min(route_deadlines) if route_deadlines else float('inf')
-    if arrival_at_depot > effective_deadline + 1e-6:
-        return False, None, None
-        
-    return True, fe_route.total_dist, fe_route.total_travel_time
+    """Lập lịch lại tuyến FE và kiểm tra tính khả thi (xem FERoute.calculate_schedule)."""
+    return fe_route.calculate_schedule()
 
 def _calculate_route_proximity(customer: "Customer", se_route: SERoute, problem: "ProblemInstance") -> float:
     if not se_route.get_customers(): return problem.get_distance(customer.id, se_route.satellite.id)
     return min(problem.get_distance(customer.id, c.id) for c in se_route.get_customers())
 
-def find_k_best_global_insertion_options_combined(customer: "Customer", solution: Solution, insertion_processor: InsertionProcessor, k: int) -> List[Dict]:
+def _simulate_fe_change(solution: Solution, fe_route: FERoute, apply_change: Callable[[], None]) -> Tuple[bool, float]:
+    """
+    Thực hiện thật thay đổi (apply_change) trong một savepoint, lập lịch lại tuyến FE rồi hoàn tác; trả về (khả thi,
+    độ tăng thành phần chính của lời giải). Chỉ dùng để đối chiếu với đánh giá thuần (config.DEBUG_CHECK_INSERTION_EVALUATOR).
+    """
+    context = solution.change_context
+    own_context = context is None
+    if own_context: context = ChangeContext(solution)
+    before = solution.get_primary_objective_cost()
+    savepoint = context.savepoint()
+    try:
+        apply_change()
+        is_feasible, _, _ = _recalculate_fe_route_and_check_feasibility(fe_route, solution.problem)
+        return is_feasible, solution.get_primary_objective_cost() - before
+    finally:
+        context.rollback_to_savepoint(savepoint)
+        if own_context: context.close()
+
+def _check_evaluation(kind: str, evaluated: Tuple[bool, float], simulated: Tuple[bool, float]):
+    if evaluated[0] != simulated[0] or (evaluated[0] and abs(evaluated[1] - simulated[1]) > 1e-6):
+        raise RuntimeError(f"Danh gia chen thuan lech ({kind}): {evaluated} != mo phong {simulated}")
+
+def _push_k_best(heap: List, k: int, counter, objective_increase: float, option: Dict):
+    """Giữ trong heap (max-heap theo objective_increase) k phương án rẻ nhất."""
+    count = next(counter)
+    if len(heap) < k: heapq.heappush(heap, (-objective_increase, count, option))
+    elif objective_increase < -heap[0][0]: heapq.heapreplace(heap, (-objective_increase, count, option))
+
+def _se_route_insertion_options(customer: "Customer", se_route: SERoute, solution: Solution, insertion_processor: InsertionProcessor, k: int) -> List[Tuple[float, Dict]]:
+    """k phương án chèn customer vào se_route rẻ nhất, dạng (objective_increase, option). Chỉ phụ thuộc se_route và tuyến FE phục vụ nó."""
     problem = solution.problem
-    best_options_heap = []
-    counter = itertools.count()
+    local_insertions = insertion_processor.find_all_feasible_insertions_for_se_route(se_route, customer)
+    if not local_insertions: return []
     primary_key_increase = 'dist_increase' if config.PRIMARY_OBJECTIVE == "DISTANCE" else 'time_increase'
+    use_dist = config.PRIMARY_OBJECTIVE == "DISTANCE"
+    heap = []; counter = itertools.count()
+    cid = customer.id
+    customer_demand, is_delivery = problem.node_demand[cid], problem.node_kind[cid] == KIND_DELIVERY
+    fe_route = list(se_route.serving_fe_routes)[0]
+    # <<< ĐÁNH GIÁ O(1), KHÔNG THAY ĐỔI TUYẾN >>>
+    # Nếu tuyến SE sau khi chèn vẫn kết thúc trước khi xe FE rời vệ tinh thì lịch trình FE (và chi phí FE)
+    # không đổi: chỉ cần kiểm tra deadline khi về depot và tải trên xe FE (hàng giao nằm trên xe từ depot
+    # tới vệ tinh, hàng nhận từ vệ tinh về depot). Chèn chỉ làm các tuyến SE khó hơn nên không có thứ tự vệ tinh
+    # mới nào trở nên khả thi (xem FERoute.satellite_order): thứ tự hiện tại vẫn là tối ưu.
+    events = fe_route.schedule
+    pickup_idx = fe_route.pickup_event_index(se_route.satellite.id)
+    sat_departure, fe_unchanged_feasible = None, False
+    if pickup_idx is not None:
+        sat_departure = events[pickup_idx].departure_time
+        loaded_events = events[:pickup_idx - 1] if is_delivery else events[pickup_idx:-1]
+        fe_unchanged_feasible = (events[-1].arrival_time <= problem.node_deadline[cid] + 1e-6
+                                 and max(e.load_after for e in loaded_events) + customer_demand <= problem.fe_vehicle_capacity + 1e-6)
+    for local_option in local_insertions:
+        new_se_end = se_route.evaluate_insertion(cid, local_option['pos'])
+        if new_se_end is None: continue
+        if fe_unchanged_feasible and new_se_end <= sat_departure:
+            objective_increase = config.WEIGHT_PRIMARY * local_option[primary_key_increase]
+            _push_k_best(heap, k, counter, objective_increase, {'objective_increase': objective_increase, 'type': 'insert_into_existing_se', 'se_route': se_route, 'se_pos': local_option['pos']})
+            continue
+        # Tuyến SE kết thúc muộn hơn làm dịch lịch trình FE: đánh giá thuần lịch trình FE mới (không thay đổi tuyến).
+        is_feasible, dist_increase, time_increase, _ = insertion_processor.evaluate_insertion(se_route, customer, local_option['pos'])
+        primary_increase = dist_increase if use_dist else time_increase
+        if config.DEBUG_CHECK_INSERTION_EVALUATOR:
+            simulated = _simulate_fe_change(solution, fe_route, lambda: solution.insert_customer(se_route, customer, local_option['pos']))
+            _check_evaluation('insert_into_existing_se', (is_feasible, primary_increase), simulated)
+        if is_feasible:
+            objective_increase = config.WEIGHT_PRIMARY * primary_increase
+            option = {'objective_increase': objective_increase, 'type': 'insert_into_existing_se', 'se_route': se_route, 'se_pos': local_option['pos']}
+            _push_k_best(heap, k, counter, objective_increase, option)
+    return [(-neg_cost, option) for neg_cost, _, option in heap]
+
+def _new_se_route_for(customer: "Customer", satellite: "Satellite", problem: "ProblemInstance") -> Tuple[SERoute, Tuple[float, float, float, float], Optional[Tuple[float, Dict]]]:
+    """
+    Tuyến SE tạm chỉ phục vụ customer tại satellite, profile xuất phát của nó và phương án mở tuyến SE + tuyến FE mới
+    (None nếu không khả thi). Chỉ phụ thuộc customer và satellite.
+    """
     primary_route_attr = 'total_dist' if config.PRIMARY_OBJECTIVE == "DISTANCE" else 'total_travel_time'
-    def add_option_to_heap(objective_increase, option_details):
-        count = next(counter)
-        if len(best_options_heap) < k: heapq.heappush(best_options_heap, (-objective_increase, count, option_details))
-        elif objective_increase < -best_options_heap[0][0]: heapq.heapreplace(best_options_heap, (-objective_increase, count, option_details))
-    candidate_se_routes = sorted([r for r in solution.se_routes if r.serving_fe_routes], key=lambda r: _calculate_route_proximity(customer, r, problem))
+    temp_new_se = SERoute(satellite, problem)
+    temp_new_se.insert_customer_at_pos(customer, 1)
+    new_fe_option = None
+    if temp_new_se.total_load_delivery <= problem.fe_vehicle_capacity + 1e-6:
+        temp_fe_for_new = FERoute(problem)
+        temp_fe_for_new.add_serviced_se_route(temp_new_se)
+        is_feasible, new_fe_dist, new_fe_time = _recalculate_fe_route_and_check_feasibility(temp_fe_for_new, problem)
+        if is_feasible:
+            new_fe_primary = new_fe_dist if config.PRIMARY_OBJECTIVE == "DISTANCE" else new_fe_time
+            primary_increase = getattr(temp_new_se, primary_route_attr) + new_fe_primary
+            objective_increase = config.WEIGHT_PRIMARY * primary_increase
+            if config.OPTIMIZE_VEHICLE_COUNT: objective_increase += config.WEIGHT_SE_VEHICLE + config.WEIGHT_FE_VEHICLE
+            new_fe_option = (objective_increase, {'objective_increase': objective_increase, 'type': 'create_new_se_new_fe', 'new_satellite': satellite})
+    return temp_new_se, temp_new_se.departure_profile(), new_fe_option
+
+def _expand_fe_option(temp_new_se: SERoute, new_se_profile: Tuple[float, float, float, float], fe_route: FERoute, solution: Solution) -> Optional[Tuple[float, Dict]]:
+    """Phương án mở tuyến SE mới (temp_new_se) do tuyến FE hiện có fe_route phục vụ, hoặc None nếu không khả thi."""
+    problem = solution.problem
+    # Loại O(1) theo tải cache của tuyến FE: tải khi rời depot và khi về depot đều không được vượt sức chứa.
+    if (fe_route.total_load_delivery + temp_new_se.total_load_delivery > problem.fe_vehicle_capacity + 1e-6
+            or fe_route.total_load_pickup + temp_new_se.total_load_pickup > problem.fe_vehicle_capacity + 1e-6): return None
+    use_dist = config.PRIMARY_OBJECTIVE == "DISTANCE"
+    primary_route_attr = 'total_dist' if use_dist else 'total_travel_time'
+    satellite = temp_new_se.satellite
+    is_feasible_expand, new_fe_dist, new_fe_time, _ = fe_route.evaluate_sat_change(
+        satellite.id, None, new_se_profile, temp_new_se.total_load_delivery, temp_new_se.total_load_pickup)
+    delta_fe_primary = (new_fe_dist - fe_route.total_dist) if use_dist else (new_fe_time - fe_route.total_travel_time)
+    if config.DEBUG_CHECK_INSERTION_EVALUATOR:
+        simulated = _simulate_fe_change(solution, fe_route, lambda: solution.link_routes(fe_route, temp_new_se))
+        # Tuyến SE tạm không thuộc lời giải: mô phỏng chỉ thấy phần thay đổi của tuyến FE.
+        _check_evaluation('create_new_se_expand_fe', (is_feasible_expand, delta_fe_primary), simulated)
+    if not is_feasible_expand: return None
+    primary_increase = getattr(temp_new_se, primary_route_attr) + delta_fe_primary
+    objective_increase = config.WEIGHT_PRIMARY * primary_increase
+    if config.OPTIMIZE_VEHICLE_COUNT: objective_increase += config.WEIGHT_SE_VEHICLE
+    return objective_increase, {'objective_increase': objective_increase, 'type': 'create_new_se_expand_fe', 'new_satellite': satellite, 'fe_route': fe_route}
+
+class InsertionOptionCache:
+    """
+    Cache các phương án chèn trong một lần repair. Một lần chèn chỉ thay đổi một tuyến SE và tuyến FE phục vụ nó
+    (kèm thời điểm xuất phát của các tuyến SE cùng tuyến FE), nên các phương án được lưu theo từng cặp
+    (khách hàng, tuyến) kèm version của các tuyến mà chúng phụ thuộc (xem _route_versions):
+      - (khách hàng, tuyến SE) -> k phương án chèn rẻ nhất, khóa (version SE, version FE phục vụ);
+      - (khách hàng, tuyến SE) -> độ gần dùng để chọn tuyến ứng viên, khóa version SE;
+      - (khách hàng, vệ tinh) -> tuyến SE tạm và phương án mở tuyến FE mới (không phụ thuộc lời giải);
+      - (khách hàng, vệ tinh, tuyến FE) -> phương án mở tuyến SE mới trên tuyến FE, khóa version FE.
+    Mục có version khác được tính lại khi đọc, nên sau mỗi lần chèn chỉ các phương án chạm tới tuyến bị thay đổi
+    được đánh giá lại. Chỉ dùng trong một lần repair: các phương án giữ tham chiếu tới tuyến của lời giải.
+    """
+    def __init__(self, solution: Solution, insertion_processor: InsertionProcessor, k: int):
+        self.solution = solution
+        self.insertion_processor = insertion_processor
+        self.k = k
+        self._se_options: Dict[Tuple[int, SERoute], Tuple[Tuple[int, int], List[Tuple[float, Dict]]]] = {}
+        self._proximity: Dict[Tuple[int, SERoute], Tuple[int, float]] = {}
+        self._new_se: Dict[Tuple[int, int], Tuple[SERoute, Tuple[float, float, float, float], Optional[Tuple[float, Dict]]]] = {}
+        self._expand: Dict[Tuple[int, int, FERoute], Tuple[int, Optional[Tuple[float, Dict]]]] = {}
+
+    def route_proximity(self, customer: "Customer", se_route: SERoute) -> float:
+        key = (customer.id, se_route)
+        entry = self._proximity.get(key)
+        if entry is None or entry[0] != se_route.version:
+            entry = self._proximity[key] = (se_route.version, _calculate_route_proximity(customer, se_route, self.solution.problem))
+        return entry[1]
+
+    def se_route_options(self, customer: "Customer", se_route: SERoute) -> List[Tuple[float, Dict]]:
+        key = (customer.id, se_route)
+        versions = (se_route.version, next(iter(se_route.serving_fe_routes)).version)
+        entry = self._se_options.get(key)
+        if entry is not None and entry[0] == versions:
+            return entry[1]
+        options = _se_route_insertion_options(customer, se_route, self.solution, self.insertion_processor, self.k)
+        self._se_options[key] = (versions, options)
+        return options
+
+    def new_se_route(self, customer: "Customer", satellite: "Satellite") -> Tuple[SERoute, Tuple[float, float, float, float], Optional[Tuple[float, Dict]]]:
+        key = (customer.id, satellite.id)
+        entry = self._new_se.get(key)
+        if entry is None: entry = self._new_se[key] = _new_se_route_for(customer, satellite, self.solution.problem)
+        return entry
+
+    def expand_fe_option(self, customer: "Customer", temp_new_se: SERoute, new_se_profile: Tuple[float, float, float, float], fe_route: FERoute) -> Optional[Tuple[float, Dict]]:
+        key = (customer.id, temp_new_se.satellite.id, fe_route)
+        entry = self._expand.get(key)
+        if entry is not None and entry[0] == fe_route.version:
+            return entry[1]
+        option = _expand_fe_option(temp_new_se, new_se_profile, fe_route, self.solution)
+        self._expand[key] = (fe_route.version, option)
+        return option
+
+def find_k_best_global_insertion_options_combined(customer: "Customer", solution: Solution, insertion_processor: InsertionProcessor, k: int,
+                                                  cache: Optional[InsertionOptionCache] = None) -> List[Dict]:
+    """
+    k phương án chèn customer rẻ nhất trên toàn lời giải. Với cache (cùng lời giải, cache.k >= k), các phương án của
+    những tuyến chưa thay đổi từ lần gọi trước được lấy lại thay vì đánh giá lại.
+    """
+    problem = solution.problem
+    best_options_heap = []
+    counter = itertools.count()
+    serve_mask = problem.sat_serve_mask
+    if cache is not None: route_proximity = cache.route_proximity
+    else: route_proximity = lambda c, r: _calculate_route_proximity(c, r, problem)
+    candidate_se_routes = sorted([r for r in solution.se_routes if r.serving_fe_routes and (serve_mask[r.satellite.id] >> customer.id) & 1], key=lambda r: route_proximity(customer, r))
     for se_route in candidate_se_routes[:config.PRUNING_N_SE_ROUTE_CANDIDATES]:
-        local_insertions = insertion_processor.find_all_feasible_insertions_for_se_route(se_route, customer)
-        if not local_insertions: continue
-        for local_option in local_insertions:
-            fe_route = list(se_route.serving_fe_routes)[0]
-            fe_memento = fe_route.backup(); se_mementos = {se: se.backup() for se in fe_route.serviced_se_routes}
-            try:
-                se_route_to_modify = next(se for se in fe_route.serviced_se_routes if se is se_route)
-                se_route_to_modify.insert_customer_at_pos(customer, local_option['pos'])
-                is_feasible, _, _ = _recalculate_fe_route_and_check_feasibility(fe_route, problem)
-                if is_feasible:
-                    primary_increase = (getattr(se_route_to_modify, primary_route_attr) - getattr(se_mementos[se_route_to_modify], primary_route_attr)) + (getattr(fe_route, primary_route_attr) - getattr(fe_memento, primary_route_attr))
-                    objective_increase = config.WEIGHT_PRIMARY * primary_increase
-                    option = {'objective_increase': objective_increase, 'type': 'insert_into_existing_se', 'se_route': se_route, 'se_pos': local_option['pos']}
-                    add_option_to_heap(objective_increase, option)
-            finally:
-                fe_route.restore(fe_memento)
-                for se, memento in se_mementos.items(): se.restore(memento)
+        if cache is not None: route_options = cache.se_route_options(customer, se_route)
+        else: route_options = _se_route_insertion_options(customer, se_route, solution, insertion_processor, k)
+        for objective_increase, option in route_options: _push_k_best(best_options_heap, k, counter, objective_increase, option)
     candidate_satellites = problem.satellite_neighbors.get(customer.id, problem.satellites)
     for satellite in candidate_satellites:
-        temp_new_se = SERoute(satellite, problem)
-        temp_new_se.insert_customer_at_pos(customer, 1)
-        if temp_new_se.total_load_delivery <= problem.fe_vehicle_capacity + 1e-6:
-            temp_fe_for_new = FERoute(problem)
-            temp_fe_for_new.add_serviced_se_route(temp_new_se)
-            is_feasible, new_fe_dist, new_fe_time = _recalculate_fe_route_and_check_feasibility(temp_fe_for_new, problem)
-            if is_feasible:
-                new_fe_primary = new_fe_dist if config.PRIMARY_OBJECTIVE == "DISTANCE" else new_fe_time
-                primary_increase = getattr(temp_new_se, primary_route_attr) + new_fe_primary
-                objective_increase = config.WEIGHT_PRIMARY * primary_increase
-                if config.OPTIMIZE_VEHICLE_COUNT: objective_increase += config.WEIGHT_SE_VEHICLE + config.WEIGHT_FE_VEHICLE
-                option = {'objective_increase': objective_increase, 'type': 'create_new_se_new_fe', 'new_satellite': satellite}
-                add_option_to_heap(objective_increase, option)
+        if not (serve_mask[satellite.id] >> customer.id) & 1: continue
+        if cache is not None: temp_new_se, new_se_profile, new_fe_option = cache.new_se_route(customer, satellite)
+        else: temp_new_se, new_se_profile, new_fe_option = _new_se_route_for(customer, satellite, problem)
+        if new_fe_option is not None: _push_k_best(best_options_heap, k, counter, *new_fe_option)
         for fe_route in solution.fe_routes:
-            if sum(r.total_load_delivery for r in fe_route.serviced_se_routes) + temp_new_se.total_load_delivery > problem.fe_vehicle_capacity + 1e-6: continue
-            fe_memento_expand = fe_route.backup(); se_mementos_expand = {se: se.backup() for se in fe_route.serviced_se_routes}
-            try:
-                fe_route.add_serviced_se_route(temp_new_se)
-                is_feasible_expand, _, _ = _recalculate_fe_route_and_check_feasibility(fe_route, problem)
-                if is_feasible_expand:
-                    delta_fe_primary = getattr(fe_route, primary_route_attr) - getattr(fe_memento_expand, primary_route_attr)
-                    primary_increase = getattr(temp_new_se, primary_route_attr) + delta_fe_primary
-                    objective_increase = config.WEIGHT_PRIMARY * primary_increase
-                    if config.OPTIMIZE_VEHICLE_COUNT: objective_increase += config.WEIGHT_SE_VEHICLE
-                    option = {'objective_increase': objective_increase, 'type': 'create_new_se_expand_fe', 'new_satellite': satellite, 'fe_route': fe_route}
-                    add_option_to_heap(objective_increase, option)
-            finally:
-                fe_route.restore(fe_memento_expand)
-                for se, memento in se_mementos_expand.items(): se.restore(memento)
+            if cache is not None: expand_option = cache.expand_fe_option(customer, temp_new_se, new_se_profile, fe_route)
+            else: expand_option = _expand_fe_option(temp_new_se, new_se_profile, fe_route, solution)
+            if expand_option is not None: _push_k_best(best_options_heap, k, counter, *expand_option)
     sorted_options = sorted([opt for cost, count, opt in best_options_heap], key=lambda x: x['objective_increase'])
     return sorted_options
 
@@ -178,7 +272,8 @@ def find_best_global_insertion_option(customer: "Customer", solution: Solution,
     best_k_options = find_k_best_global_insertion_options_combined(customer, solution, insertion_processor, k=1)
     return best_k_options[0] if best_k_options else {'objective_increase': float('inf')}
 
-def find_k_best_global_insertion_options(customer: "Customer", solution: Solution, insertion_processor: InsertionProcessor, k: int) -> List[Dict]:
-    return find_k_best_global_insertion_options_combined(customer, solution, insertion_processor, k)
+def find_k_best_global_insertion_options(customer: "Customer", solution: Solution, insertion_processor: InsertionProcessor, k: int,
+                                         cache: Optional[InsertionOptionCache] = None) -> List[Dict]:
+    return find_k_best_global_insertion_options_combined(customer, solution, insertion_processor, k, cache)
 
 # --- END OF FILE insertion_logic.py ---
\ No newline at end of file
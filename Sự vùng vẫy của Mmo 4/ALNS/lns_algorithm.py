@@ -43,6 +43,7 @@ def run_local_search_phase(initial_state: "VRP2E_State", iterations: int, q_perc
         
         log_msg = ""
         if cost_after < cost_before:
+            context.close()
             if cost_after < best_state.cost:
                 best_state = current_state.copy()
                 log_msg = "(NEW BEST!)"
@@ -87,6 +88,7 @@ def run_alns_phase(initial_state: "VRP2E_State", iterations: int,
         q = max(2, int(num_cust * q_percentage))
         removed_customers = destroy_op_obj.function(current_state.solution, context, q)
         repair_op_obj.function(current_state.solution, context, removed_customers)
+        if config.DEBUG_CHECK_OBJECTIVE: current_state.solution.check_objective()
         cost_after_change = current_state.cost
         sigma_update, log_msg, accepted = 0, "", False
         if cost_after_change < cost_before_change:
@@ -96,6 +98,7 @@ def run_alns_phase(initial_state: "VRP2E_State", iterations: int,
         elif T > 1e-6 and random.random() < math.exp(-(cost_after_change - cost_before_change) / T):
             accepted, sigma_update = True, config.SIGMA_3_ACCEPTED
         if accepted:
+            context.close()
             operator_selector.update_scores(destroy_op_obj, repair_op_obj, sigma_update)
             if cost_after_change < best_state.cost: best_state = current_state.copy()
         else: context.rollback()
@@ -2,8 +2,12 @@
 
 # --- Phần import của file alns/repair_operators.py ---
 
+import heapq
+import itertools
 import random
-from typing import List, TYPE_CHECKING, Dict
+from typing import List, TYPE_CHECKING, Dict, Optional, Tuple
+
+import config
 
 # Import từ package 'core'
 from core.data_structures import SERoute, FERoute
@@ -11,7 +15,7 @@ from core.problem_parser import PickupCustomer
 from core.transaction import ChangeContext
 
 # Import từ cùng package 'alns'
-from .insertion_logic import InsertionProcessor, find_best_global_insertion_option, find_k_best_global_insertion_options, _recalculate_fe_route_and_check_feasibility
+from .insertion_logic import InsertionProcessor, InsertionOptionCache, find_best_global_insertion_option, find_k_best_global_insertion_options, _recalculate_fe_route_and_check_feasibility
 
 if TYPE_CHECKING:
     from core.data_structures import Solution
@@ -35,7 +39,7 @@ def _perform_insertion(solution: "Solution", context: "ChangeContext", customer_
         se_route, pos = best_option['se_route'], best_option['se_pos']
         if se_route.serving_fe_routes:
             fe_route = list(se_route.serving_fe_routes)[0]
-            se_route.insert_customer_at_pos(customer_to_insert, pos)
+            solution.insert_customer(se_route, customer_to_insert, pos)
             _recalculate_fe_route_and_check_feasibility(fe_route, problem)
         else:
              if customer_to_insert not in solution.unserved_customers:
@@ -46,10 +50,8 @@ def _perform_insertion(solution: "Solution", context: "ChangeContext", customer_
         new_se = SERoute(satellite, problem)
         new_se.insert_customer_at_pos(customer_to_insert, 1)
         solution.add_se_route(new_se)
-        context.track_new_route(new_se)
         new_fe = FERoute(problem)
         solution.add_fe_route(new_fe)
-        context.track_new_route(new_fe)
         solution.link_routes(new_fe, new_se)
         _recalculate_fe_route_and_check_feasibility(new_fe, problem)
 
@@ -58,15 +60,12 @@ def _perform_insertion(solution: "Solution", context: "ChangeContext", customer_
         new_se = SERoute(satellite, problem)
         new_se.insert_customer_at_pos(customer_to_insert, 1)
         solution.add_se_route(new_se)
-        context.track_new_route(new_se)
         solution.link_routes(fe_route, new_se)
         _recalculate_fe_route_and_check_feasibility(fe_route, problem)
         
     else:
         if customer_to_insert not in solution.unserved_customers:
             solution.unserved_customers.append(customer_to_insert)
-    
-    solution.update_customer_map()
 
 
 def greedy_repair(solution: "Solution", context: "ChangeContext", customers_to_insert: List["Customer"]):
@@ -79,33 +78,66 @@ def greedy_repair(solution: "Solution", context: "ChangeContext", customers_to_i
         best_option = find_best_global_insertion_option(customer, solution, insertion_processor)
         _perform_insertion(solution, context, customer, best_option)
                 
-def regret_insertion(solution: "Solution", context: "ChangeContext", customers_to_insert: List["Customer"], k: int = 4):
+def _option_routes(option: Dict) -> List:
+    """Các tuyến của lời giải mà phương án chèn phụ thuộc (thay đổi một trong số đó có thể làm phương án sai / lỗi thời)."""
+    option_type = option['type']
+    if option_type == 'insert_into_existing_se':
+        se_route = option['se_route']
+        return [se_route, *se_route.serving_fe_routes]
+    if option_type == 'create_new_se_expand_fe': return [option['fe_route']]
+    return []
+
+def _regret_priority(options: List[Dict], k: int) -> Tuple[int, float]:
+    """
+    Khóa ưu tiên regret-k (nhỏ hơn = chèn trước). Khách hàng có ít hơn k phương án được ưu tiên theo số phương án
+    còn thiếu (fallback regret-k: càng ít lựa chọn càng dễ mất hết nếu để muộn), sau đó theo regret = tổng chênh lệch
+    chi phí của các phương án so với phương án tốt nhất.
+    """
+    best_cost = options[0]['objective_increase']
+    regret = sum(opt['objective_increase'] - best_cost for opt in options[1:])
+    return len(options) - k, -regret
+
+def regret_insertion(solution: "Solution", context: "ChangeContext", customers_to_insert: List["Customer"], k: Optional[int] = None):
+    """
+    Chèn regret-k với hàng đợi ưu tiên cập nhật lười. Mỗi khách hàng giữ k phương án tốt nhất cùng version của các
+    tuyến mà chúng phụ thuộc; sau mỗi lần chèn chỉ những khách hàng có một tuyến trong top-k vừa thay đổi được tính lại
+    (qua InsertionOptionCache), các mục cũ trong heap bị bỏ qua khi lấy ra. Khách hàng chưa có phương án nào được
+    thử lại sau mỗi lần chèn; hết khách hàng chèn được thì những khách hàng còn lại thành unserved.
+    """
+    k = config.REGRET_K if k is None else k
     insertion_processor = InsertionProcessor(solution.problem)
-    remaining_customers = list(customers_to_insert)
-
-    while remaining_customers:
-        best_customer_to_insert = None
-        max_regret = -float('inf')
-        best_option_for_max_regret_customer = None
-
-        for customer in remaining_customers:
-            best_options = find_k_best_global_insertion_options(customer, solution, insertion_processor, k)
-            if not best_options: continue
-            
-            best_cost = best_options[0]['objective_increase']
-            regret = sum(opt['objective_increase'] - best_cost for opt in best_options[1:])
-            
-            if regret > max_regret:
-                max_regret = regret
-                best_customer_to_insert = customer
-                best_option_for_max_regret_customer = best_options[0]
-
-        if best_customer_to_insert is None:
-            solution.unserved_customers.extend(remaining_customers)
-            break
-
-        _perform_insertion(solution, context, best_customer_to_insert, best_option_for_max_regret_customer)
-        remaining_customers.remove(best_customer_to_insert)
+    option_cache = InsertionOptionCache(solution, insertion_processor, k)
+    waiting = {customer.id: customer for customer in customers_to_insert}
+    best_options: Dict[int, List[Dict]] = {}
+    route_versions: Dict[int, List[Tuple[object, int]]] = {}
+    entry_ids: Dict[int, int] = {}
+    without_options = set()
+    heap = []
+    counter = itertools.count()
+
+    def evaluate(customer: "Customer"):
+        cid = customer.id
+        options = find_k_best_global_insertion_options(customer, solution, insertion_processor, k, option_cache)
+        entry_ids.pop(cid, None); best_options.pop(cid, None); route_versions.pop(cid, None)
+        if not options: without_options.add(cid); return
+        without_options.discard(cid)
+        best_options[cid] = options
+        route_versions[cid] = [(route, route.version) for option in options for route in _option_routes(option)]
+        entry_id = next(counter)
+        entry_ids[cid] = entry_id
+        heapq.heappush(heap, (*_regret_priority(options, k), entry_id, cid))
+
+    for customer in customers_to_insert: evaluate(customer)
+    while heap:
+        *_, entry_id, cid = heapq.heappop(heap)
+        if entry_ids.get(cid) != entry_id: continue
+        customer = waiting.pop(cid)
+        del entry_ids[cid], route_versions[cid]
+        _perform_insertion(solution, context, customer, best_options.pop(cid)[0])
+        # <<< VÔ HIỆU HÓA LƯỜI: chỉ tính lại khách hàng có tuyến trong top-k đã đổi version >>>
+        stale = [c for c, versions in route_versions.items() if any(route.version != version for route, version in versions)]
+        for c in [*stale, *without_options]: evaluate(waiting[c])
+    solution.unserved_customers.extend(waiting.values())
 
 def earliest_deadline_first_insertion(solution: "Solution", context: "ChangeContext", customers_to_insert: List["Customer"]):
     insertion_processor = InsertionProcessor(solution.problem)
@@ -31,8 +31,7 @@ def create_integrated_initial_solution(problem: "ProblemInstance", random_custom
         if option_type == 'insert_into_existing_se':
             se_route, pos = best_option['se_route'], best_option['se_pos']
             fe_route = list(se_route.serving_fe_routes)[0]
-            se_route.insert_customer_at_pos(customer, pos)
-            solution.update_customer_map()
+            solution.insert_customer(se_route, customer, pos)
             _recalculate_fe_route_and_check_feasibility(fe_route, problem)
         elif option_type == 'create_new_se_new_fe':
             satellite = best_option['new_satellite']
@@ -0,0 +1,130 @@
+# --- START OF FILE benchmark.py ---
+
+# Đo hiệu năng bộ giải trên một file dữ liệu (mặc định: config.FILE_PATH).
+# Cách dùng:
+#   python benchmark.py [duong_dan_csv | synthetic:<so_khach_hang>] [so_vong_lap_alns]
+# "synthetic:1000" sinh một bài toán ngẫu nhiên 1000 khách hàng (xem write_synthetic_instance); đặt số vòng lặp
+# ALNS = 0 để chỉ đo lập lịch SE và giai đoạn tạo lời giải ban đầu.
+# Chạy cùng một lệnh trên hai phiên bản code để so sánh thời gian trung bình mỗi vòng lặp.
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import config
+from core.problem_parser import ProblemInstance
+from ALNS.solution_generator import create_integrated_initial_solution
+from ALNS.lns_algorithm import run_alns_phase
+from ALNS.insertion_logic import InsertionProcessor
+from ALNS.destroy_operators import (
+    random_removal, shaw_removal, worst_slack_removal,
+    worst_cost_removal, route_removal, satellite_removal,
+    least_utilized_route_removal
+)
+from ALNS.repair_operators import (
+    greedy_repair, regret_insertion, earliest_deadline_first_insertion,
+    farthest_first_insertion, largest_first_insertion, closest_first_insertion,
+    earliest_time_window_insertion, latest_time_window_insertion,
+    latest_deadline_first_insertion
+)
+
+DESTROY_OPERATORS = {
+    "random_removal": random_removal, "shaw_removal": shaw_removal, "worst_slack_removal": worst_slack_removal,
+    "worst_cost_removal": worst_cost_removal, "route_removal": route_removal, "satellite_removal": satellite_removal,
+    "least_utilized_route_removal": least_utilized_route_removal,
+}
+REPAIR_OPERATORS = {
+    "greedy_repair": greedy_repair, "regret_insertion": regret_insertion, "earliest_deadline_first_insertion": earliest_deadline_first_insertion,
+    "farthest_first_insertion": farthest_first_insertion, "largest_first_insertion": largest_first_insertion, "closest_first_insertion": closest_first_insertion,
+    "earliest_time_window_insertion": earliest_time_window_insertion, "latest_time_window_insertion": latest_time_window_insertion,
+    "latest_deadline_first_insertion": latest_deadline_first_insertion
+}
+
+def write_synthetic_instance(path: str, n_customers: int, n_satellites: int = 20, seed: int = config.RANDOM_SEED):
+    """
+    Ghi ra path một bài toán ngẫu nhiên cùng định dạng CSV với dữ liệu gốc: depot ở giữa lưới 100x100,
+    n_satellites vệ tinh, khách hàng giao / lấy hàng với cửa sổ thời gian trong [0, 1000] và deadline cho khách lấy hàng.
+    """
+    rng = np.random.default_rng(seed)
+    n_nodes = 1 + n_satellites + n_customers
+    node_type = np.concatenate(([config.HUB_TYPE], np.full(n_satellites, config.SATELLITE_TYPE),
+                                rng.choice([config.DELIVERY_TYPE, config.PICKUP_TYPE], n_customers)))
+    is_customer = node_type >= config.DELIVERY_TYPE
+    early = np.where(is_customer, rng.integers(0, 400, n_nodes), 0)
+    latest = np.where(is_customer, early + rng.integers(60, 250, n_nodes), 1000)
+    df = pd.DataFrame({
+        'Type': node_type, 'X': np.where(node_type == config.HUB_TYPE, 50, rng.integers(0, 101, n_nodes)),
+        'Y': np.where(node_type == config.HUB_TYPE, 50, rng.integers(0, 101, n_nodes)),
+        'Demand': np.where(is_customer, rng.integers(1, 5, n_nodes), 0),
+        'Service Time': np.where(is_customer, 10, np.where(node_type == config.SATELLITE_TYPE, 5, 0)),
+        'Early': early, 'Latest': latest,
+        'Deadline': np.where(node_type == config.PICKUP_TYPE, latest + rng.integers(100, 300, n_nodes), 0),
+        'FE Cap': config.FE_VEHICLE_CAPACITY, 'SE Cap': config.SE_VEHICLE_CAPACITY})
+    df.to_csv(path, index=False)
+
+def load_problem(source: str) -> ProblemInstance:
+    """Đọc bài toán từ file CSV, hoặc sinh bài toán ngẫu nhiên nếu source có dạng "synthetic:<so_khach_hang>"."""
+    if not source.startswith("synthetic:"):
+        return ProblemInstance(file_path=source, vehicle_speed=config.VEHICLE_SPEED, verbose=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"synthetic_{source.split(':', 1)[1]}.csv")
+        write_synthetic_instance(path, int(source.split(':', 1)[1]))
+        return ProblemInstance(file_path=path, vehicle_speed=config.VEHICLE_SPEED, verbose=False, use_cache=False)
+
+def bench_construction(problem: ProblemInstance, seed: int = config.RANDOM_SEED) -> float:
+    """Thời gian (s) tạo lời giải tham lam ban đầu (create_integrated_initial_solution)."""
+    random.seed(seed)
+    start = time.perf_counter()
+    create_integrated_initial_solution(problem, verbose=False)
+    return time.perf_counter() - start
+
+def bench_alns_iterations(problem: ProblemInstance, iterations: int, seed: int = config.RANDOM_SEED) -> float:
+    """Trả về thời gian trung bình (ms) của một vòng lặp ALNS, tính từ lời giải tham lam ban đầu."""
+    random.seed(seed)
+    initial_state = create_integrated_initial_solution(problem, verbose=False)
+    start = time.perf_counter()
+    run_alns_phase(initial_state, iterations, DESTROY_OPERATORS, REPAIR_OPERATORS, verbose=False, track_history=False)
+    return (time.perf_counter() - start) * 1000.0 / max(iterations, 1)
+
+def bench_se_hot_paths(problem: ProblemInstance, repeats: int = 20, seed: int = config.RANDOM_SEED) -> dict:
+    """
+    Đo riêng hai hàm nóng nhất của tuyến SE trên lời giải ban đầu: lập lịch đầy đủ
+    và liệt kê các vị trí chèn khả thi (µs mỗi lần gọi).
+    """
+    random.seed(seed)
+    solution = create_integrated_initial_solution(problem, verbose=False).solution
+    processor = InsertionProcessor(problem)
+    routes = solution.se_routes
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for route in routes: route.calculate_full_schedule_and_slacks()
+    schedule_us = (time.perf_counter() - start) * 1e6 / max(repeats * len(routes), 1)
+    customers = problem.customers
+    start = time.perf_counter()
+    for _ in range(max(repeats // 10, 1)):
+        for route in routes:
+            for customer in customers: processor.find_all_feasible_insertions_for_se_route(route, customer)
+    insertion_us = (time.perf_counter() - start) * 1e6 / max(max(repeats // 10, 1) * len(routes) * len(customers), 1)
+    return {"schedule_us": schedule_us, "insertion_scan_us": insertion_us}
+
+def main():
+    file_path = sys.argv[1] if len(sys.argv) > 1 else config.FILE_PATH
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    problem = load_problem(file_path)
+    hot = bench_se_hot_paths(problem)
+    print(f"SE schedule recomputation : {hot['schedule_us']:.2f} us/call")
+    print(f"SE insertion position scan: {hot['insertion_scan_us']:.2f} us/call")
+    print(f"Initial construction      : {bench_construction(problem):.2f} s ({len(problem.customers)} customers)")
+    if iterations > 0:
+        per_iter = bench_alns_iterations(problem, iterations)
+        print(f"ALNS                      : {per_iter:.2f} ms/iteration ({iterations} iterations)")
+
+if __name__ == "__main__":
+    main()
+
+# --- END OF FILE benchmark.py ---
@@ -74,6 +74,34 @@ PRUNING_K_CUSTOMER_NEIGHBORS = 20
 PRUNING_M_SATELLITE_NEIGHBORS = 3
 # Số lượng tuyến SE hàng đầu (theo độ gần) để xem xét chèn vào.
 PRUNING_N_SE_ROUTE_CANDIDATES = 2
+# Số phương án chèn tốt nhất dùng để tính regret trong regret_insertion (regret-k).
+REGRET_K = 4
+
+# ----- 2.8. Cấu hình hiệu năng (Performance) -----
+# Kiểu dữ liệu của ma trận khoảng cách / thời gian di chuyển.
+# Giá trị hợp lệ: "float64" (mặc định, chính xác) hoặc "float32" (tiết kiệm một nửa bộ nhớ cho bài toán lớn).
+DISTANCE_MATRIX_DTYPE = "float64"
+# Lưu bài toán đã parse (thuộc tính node, ma trận, láng giềng) ra file nhị phân để các lần chạy sau
+# đọc lại bằng mmap thay vì parse CSV và tính toán lại. Khóa cache gồm hash nội dung file CSV,
+# tốc độ xe và các tham số pruning, nên sửa dữ liệu hay tham số sẽ tự động tạo cache mới.
+ENABLE_INSTANCE_CACHE = True
+# Thư mục chứa cache của các bài toán.
+INSTANCE_CACHE_DIR = ".instance_cache"
+# Thứ tự ghé vệ tinh của tuyến FE được chọn bằng quy hoạch động trên tập con (O(2^n * n^2) với n vệ tinh),
+# có xét tải trọng sau mỗi vệ tinh và deadline lấy hàng. Tuyến FE qua nhiều vệ tinh hơn ngưỡng này
+# dùng thứ tự theo khoảng cách tới depot.
+FE_SEQUENCING_MAX_SATELLITES = 6
+# Số kết quả sắp thứ tự FE được ghi nhớ (cache LRU, khóa là tập vệ tinh kèm tải và profile thời gian).
+FE_SEQUENCING_CACHE_SIZE = 4096
+# Gỡ lỗi: sau mỗi thay đổi, so sánh map khách hàng -> tuyến SE (được cập nhật tăng dần) với map dựng lại
+# từ đầu và báo lỗi nếu lệch. Chậm (O(N) mỗi thay đổi), chỉ bật khi kiểm tra.
+DEBUG_CHECK_CUSTOMER_MAP = False
+# Gỡ lỗi: so sánh hàm mục tiêu cộng dồn theo delta của Solution với giá trị tính lại từ đầu sau mỗi vòng lặp ALNS
+# và mỗi lần rollback (O(N) mỗi lần kiểm tra).
+DEBUG_CHECK_OBJECTIVE = False
+# Gỡ lỗi: đối chiếu mỗi đánh giá chèn thuần (InsertionProcessor.evaluate_insertion, FERoute.evaluate_sat_change)
+# với việc chèn thật trong một savepoint rồi hoàn tác; báo lỗi nếu khác về tính khả thi hay chi phí.
+DEBUG_CHECK_INSERTION_EVALUATOR = False
 
 # ==============================================================================
 # 3. CẤU HÌNH HÀM MỤC TIÊU (OBJECTIVE FUNCTION)
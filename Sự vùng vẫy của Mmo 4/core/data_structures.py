@@ -3,32 +3,290 @@
 # --- Phần import của file core/data_structures.py ---
 
 from __future__ import annotations
-import copy
-from typing import Dict, List, Set, TYPE_CHECKING
+from array import array
+from itertools import accumulate, count
+from typing import Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING
 
 import config
 # Import tương đối từ cùng package 'core'
-from .transaction import RouteMemento
+from .transaction import RouteMemento, OP_INSERT_CUSTOMER, OP_REMOVE_CUSTOMERS, OP_ADD_ROUTE, OP_REMOVE_ROUTE, OP_LINK, OP_UNLINK
+from .problem_parser import KIND_DELIVERY
 
 # TYPE_CHECKING block để tránh circular import lúc runtime
 if TYPE_CHECKING:
     from .problem_parser import ProblemInstance, Customer, Satellite, PickupCustomer
-class FERoute:
+    from .transaction import ChangeContext
+
+# Nguồn version dùng chung cho mọi tuyến: mỗi trạng thái mới của một tuyến nhận một số lớn hơn mọi số đã cấp,
+# nên cặp (tuyến, version) xác định duy nhất nội dung tuyến và dùng được làm khóa cache.
+_route_versions = count(1)
+
+# Tổng chi phí di chuyển của lời giải được cộng dồn dưới dạng số nguyên (đơn vị 2^-32): cộng / trừ số nguyên là
+# chính xác, nên tổng luôn bằng đúng tổng các giá trị đã lượng tử hóa của các tuyến hiện có, dù tuyến bị sửa
+# rồi khôi phục bao nhiêu lần (không tích lũy sai số làm tròn như khi cộng dồn số thực).
+_OBJECTIVE_SCALE = float(1 << 32)
+
+class _TrackedRouteTotals:
+    """
+    total_dist / total_travel_time của một tuyến dưới dạng property: mỗi lần gán, phần chênh lệch được cộng vào
+    tổng của lời giải đang chứa tuyến (_owner, đặt bởi Solution.add_* / remove_*), nên Solution đọc chi phí trong O(1).
+    """
+    __slots__ = ()
+
+    @property
+    def total_dist(self) -> float: return self._total_dist
+    @total_dist.setter
+    def total_dist(self, value: float):
+        owner = self._owner
+        if owner is not None: owner._dist_units += round(value * _OBJECTIVE_SCALE) - round(self._total_dist * _OBJECTIVE_SCALE)
+        self._total_dist = value
+
+    @property
+    def total_travel_time(self) -> float: return self._total_travel_time
+    @total_travel_time.setter
+    def total_travel_time(self, value: float):
+        owner = self._owner
+        if owner is not None: owner._time_units += round(value * _OBJECTIVE_SCALE) - round(self._total_travel_time * _OBJECTIVE_SCALE)
+        self._total_travel_time = value
+
+class FEScheduleEvent:
+    """
+    Một sự kiện trong lịch trình tuyến FE: DEPART_DEPOT, UNLOAD_DELIV / LOAD_PICKUP tại vệ tinh, ARRIVE_DEPOT.
+    Bản ghi không bị sửa sau khi tạo (xem bất biến ở RouteMemento).
+    """
+    __slots__ = ('activity', 'node_id', 'load_change', 'load_after', 'arrival_time', 'start_svc_time', 'departure_time')
+
+    def __init__(self, activity: str, node_id: int, load_change: float, load_after: float, arrival_time: float, start_svc_time: float, departure_time: float):
+        self.activity = activity; self.node_id = node_id
+        self.load_change = load_change; self.load_after = load_after
+        self.arrival_time = arrival_time; self.start_svc_time = start_svc_time; self.departure_time = departure_time
+
+    def __repr__(self) -> str:
+        return (f"FEScheduleEvent({self.activity}, node={self.node_id}, load_after={self.load_after:.2f}, "
+                f"arrival={self.arrival_time:.2f}, departure={self.departure_time:.2f})")
+
+class FERoute(_TrackedRouteTotals):
     def __init__(self, problem: "ProblemInstance"):
         self.problem = problem
+        self._owner: Optional[Solution] = None
         self.serviced_se_routes: Set[SERoute] = set()
-        self.schedule: List[Dict] = []
-        self.total_dist: float = 0.0
+        # Lịch trình: DEPART_DEPOT, rồi (UNLOAD_DELIV, LOAD_PICKUP) cho vệ tinh thứ i trên đường đi ở chỉ số
+        # (2i - 1, 2i), cuối cùng ARRIVE_DEPOT. _path: depot, các vệ tinh theo thứ tự ghé, depot.
+        self._schedule: List[FEScheduleEvent] = []
+        self._path: List[int] = []
+        self._total_dist: float = 0.0
         self.total_time: float = 0.0
-        self.total_travel_time: float = 0.0
+        self._total_travel_time: float = 0.0
         self.route_deadline: float = float('inf')
+        # <<< LỊCH TRÌNH LƯỜI (LAZY) + PHIÊN BẢN >>>
+        # Thay đổi tập tuyến SE (hoặc một tuyến SE được phục vụ) chỉ đánh dấu cần lập lịch lại; lịch trình được
+        # tính khi đọc lần đầu hoặc khi gọi calculate_schedule(). version nhận số mới ở mỗi thay đổi
+        # (xem _route_versions), dùng làm khóa cho các cache bên ngoài.
+        self._schedule_dirty: bool = False
+        self.version: int = next(_route_versions)
+        # Kết quả lập lịch theo vệ tinh của lần tính trước: sat_id -> (thời điểm tới, {(tuyến SE, version)},
+        # thời điểm xong muộn nhất của các tuyến SE, deadline nhỏ nhất). Dùng để bỏ qua các vệ tinh không đổi.
+        self._sat_schedule_cache: Dict[int, tuple] = {}
+        # <<< CHỈ MỤC TUYẾN SE THEO VỆ TINH + TẢI TRỌNG CACHE >>>
+        # sat_id -> tuple các tuyến SE tại vệ tinh, cập nhật trong add/remove_serviced_se_route (copy-on-write,
+        # xem bất biến ở RouteMemento).
+        self.se_routes_by_sat: Dict[int, Tuple[SERoute, ...]] = {}
+        # sat_id -> (tải giao, tải nhận) cùng tổng của cả tuyến: cập nhật trong add/remove, tính lại khi đọc
+        # sau khi một tuyến SE được phục vụ thay đổi (mark_dirty).
+        self._sat_loads: Dict[int, Tuple[float, float]] = {}
+        self._total_load_delivery: float = 0.0
+        self._total_load_pickup: float = 0.0
+        self._loads_dirty: bool = False
+
+    @property
+    def schedule(self) -> List[FEScheduleEvent]: self.ensure_schedule(); return self._schedule
+    @property
+    def path(self) -> List[int]: self.ensure_schedule(); return self._path
+    @property
+    def sat_loads(self) -> Dict[int, Tuple[float, float]]: self._ensure_loads(); return self._sat_loads
+    @property
+    def total_load_delivery(self) -> float: self._ensure_loads(); return self._total_load_delivery
+    @property
+    def total_load_pickup(self) -> float: self._ensure_loads(); return self._total_load_pickup
+
+    def mark_dirty(self): self._schedule_dirty = self._loads_dirty = True; self.version = next(_route_versions)
+    def _ensure_loads(self):
+        if self._loads_dirty: self._update_loads(self.se_routes_by_sat)
+
+    def _update_loads(self, sat_ids):
+        """Tính lại tải giao / nhận của các vệ tinh trong sat_ids (bỏ vệ tinh không còn tuyến SE) và tổng của tuyến."""
+        sat_loads = dict(self._sat_loads) if not self._loads_dirty else {}
+        for sat_id in sat_ids:
+            se_routes = self.se_routes_by_sat.get(sat_id)
+            if se_routes: sat_loads[sat_id] = (sum(r.total_load_delivery for r in se_routes), sum(r.total_load_pickup for r in se_routes))
+            else: sat_loads.pop(sat_id, None)
+        self._sat_loads = sat_loads
+        self._total_load_delivery = sum(loads[0] for loads in sat_loads.values())
+        self._total_load_pickup = sum(loads[1] for loads in sat_loads.values())
+        self._loads_dirty = False
+    def ensure_schedule(self):
+        if self._schedule_dirty: self.calculate_schedule()
+
+    def calculate_schedule(self) -> Tuple[bool, Optional[float], Optional[float]]:
+        """
+        Lập lịch tuyến FE: đi qua các vệ tinh theo thứ tự của satellite_order, đặt thời điểm xuất phát cho
+        các tuyến SE tại mỗi vệ tinh, rồi kiểm tra cửa sổ thời gian, tải trọng sau mỗi vệ tinh và deadline hiệu dụng.
+        Trả về (khả thi, tổng quãng đường, tổng thời gian di chuyển); (False, None, None) nếu không khả thi.
+
+        Tính tăng dần: một vệ tinh có thời điểm xe FE tới và các tuyến SE (theo version) giống lần tính trước
+        được dùng lại kết quả cũ, không lập lịch lại các tuyến SE và không kiểm tra lại từng khách hàng.
+        Vì vậy phần đầu tuyến trước vệ tinh thay đổi đầu tiên luôn được dùng lại, và việc lan truyền dừng
+        ngay khi thời điểm tới một vệ tinh phía sau không đổi.
+        """
+        self._schedule_dirty = False
+        problem = self.problem
+        if not self.serviced_se_routes:
+            self.total_dist = 0.0
+            self._schedule = []; self._path = []
+            self.calculate_route_properties()
+            return True, 0.0, 0.0
+            
+        depot = problem.depot
+        
+        # <<< BƯỚC 1: TÍNH TẢI TRỌNG BAN ĐẦU >>>
+        initial_delivery_load = self.total_load_delivery
+        
+        # <<< BƯỚC 2: KIỂM TRA TẢI TRỌNG NGAY LẬP TỨC >>>
+        if initial_delivery_load > problem.fe_vehicle_capacity + 1e-6:
+            return False, None, None # Báo cáo không khả thi ngay lập tức
+
+        se_routes_by_sat, sat_loads = self.se_routes_by_sat, self._sat_loads
+        sats_list = self.satellite_order(se_routes_by_sat)
+        
+        schedule = []
+        current_time = 0.0
+        current_load = initial_delivery_load # Sử dụng lại giá trị đã tính
+        
+        schedule.append(FEScheduleEvent('DEPART_DEPOT', depot.id, current_load, current_load, 0.0, 0.0, 0.0))
+        
+        last_node_id = depot.id
+        effective_deadline = float('inf')
+        node_due_time, node_deadline = problem.node_due_time, problem.node_deadline
+        time_rows = problem.time_rows
+        sat_cache, new_sat_cache = self._sat_schedule_cache, {}
+
+        for sat_id in sats_list:
+            arrival_at_sat = current_time + time_rows[last_node_id][sat_id]
+            se_routes_at_sat = se_routes_by_sat[sat_id]
+            del_load_at_sat, pickup_load_at_sat = sat_loads[sat_id]
+            current_load -= del_load_at_sat
+            schedule.append(FEScheduleEvent('UNLOAD_DELIV', sat_id, -del_load_at_sat, current_load, arrival_at_sat, arrival_at_sat, arrival_at_sat))
+            cached = sat_cache.get(sat_id)
+            se_key = frozenset((r, r.version) for r in se_routes_at_sat)
+            if cached is not None and cached[0] == arrival_at_sat and cached[1] == se_key:
+                latest_se_finish, sat_deadline = cached[2], cached[3]
+            else:
+                latest_se_finish = 0; sat_deadline = float('inf')
+                for se_route in se_routes_at_sat:
+                    # Tuyến SE chỉ được lập lịch lại khi thời điểm xuất phát thay đổi hoặc tuyến đã bị sửa.
+                    se_route.set_start_time(arrival_at_sat)
+                    start_times = se_route.service_start_times
+                    for pos in range(1, len(se_route.nodes_id) - 1):
+                        cust_id = se_route.nodes_id[pos]
+                        if start_times[pos] > node_due_time[cust_id] + 1e-6:
+                            return False, None, None
+                        if node_deadline[cust_id] < sat_deadline: sat_deadline = node_deadline[cust_id]
+                    latest_se_finish = max(latest_se_finish, start_times[-1])
+                se_key = frozenset((r, r.version) for r in se_routes_at_sat)
+            new_sat_cache[sat_id] = (arrival_at_sat, se_key, latest_se_finish, sat_deadline)
+            effective_deadline = min(effective_deadline, sat_deadline)
+            departure_from_sat = latest_se_finish
+            current_load += pickup_load_at_sat
+            if current_load > problem.fe_vehicle_capacity + 1e-6: return False, None, None
+            schedule.append(FEScheduleEvent('LOAD_PICKUP', sat_id, pickup_load_at_sat, current_load, latest_se_finish, latest_se_finish, departure_from_sat))
+            current_time = departure_from_sat
+            last_node_id = sat_id
+
+        arrival_at_depot = current_time + time_rows[last_node_id][depot.id]
+        schedule.append(FEScheduleEvent('ARRIVE_DEPOT', depot.id, -current_load, 0, arrival_at_depot, arrival_at_depot, arrival_at_depot))
+        
+        self._schedule = schedule
+        self._path = [depot.id, *sats_list, depot.id]
+        self._sat_schedule_cache = new_sat_cache
+        self.calculate_route_properties(route_deadline=effective_deadline)
+        
+        if arrival_at_depot > effective_deadline + 1e-6:
+            return False, None, None
+            
+        return True, self.total_dist, self.total_travel_time
+
+    def satellite_order(self, se_routes_by_sat: Dict[int, Tuple["SERoute", ...]]) -> List[int]:
+        """
+        Thứ tự ghé vệ tinh: tối ưu theo problem.fe_sequencer (bitmask DP trên profile xuất phát của các tuyến SE),
+        hoặc theo khoảng cách tới depot nếu tuyến qua quá nhiều vệ tinh hay không tìm được thứ tự khả thi.
+        """
+        if len(se_routes_by_sat) > 1:
+            sat_profiles = {sat_id: self._merge_profiles(r.departure_profile() for r in se_routes) for sat_id, se_routes in se_routes_by_sat.items()}
+            return self._order_from_profiles(sat_profiles, self.sat_loads)
+        return list(se_routes_by_sat)
+
+    @staticmethod
+    def _merge_profiles(se_profiles) -> Tuple[float, float, float, float]:
+        """
+        Profile xuất phát gộp của các tuyến SE tại một vệ tinh (xem SERoute.departure_profile): (thời điểm tới muộn
+        nhất, thời lượng, thời điểm xong sớm nhất, deadline nhỏ nhất).
+        """
+        latest_arrival, duration, earliest_end, min_deadline = float('inf'), 0.0, 0.0, float('inf')
+        for se_latest, se_duration, se_earliest_end, se_deadline in se_profiles:
+            latest_arrival = min(latest_arrival, se_latest); duration = max(duration, se_duration)
+            earliest_end = max(earliest_end, se_earliest_end); min_deadline = min(min_deadline, se_deadline)
+        return latest_arrival, duration, earliest_end, min_deadline
+
+    def _order_from_profiles(self, sat_profiles: Dict[int, Tuple[float, float, float, float]], sat_loads: Dict[int, Tuple[float, float]]) -> List[int]:
+        problem = self.problem
+        if len(sat_profiles) > 1:
+            route_deadline = min(profile[3] for profile in sat_profiles.values())
+            profiles = tuple((sat_id, *sat_loads[sat_id], *sat_profiles[sat_id][:3]) for sat_id in sorted(sat_profiles))
+            order = problem.fe_sequencer.best_order(profiles, route_deadline)
+            if order is not None: return list(order)
+        depot_dist_row = problem.dist_rows[problem.depot.id]
+        return sorted(sat_profiles, key=lambda sat_id: depot_dist_row[sat_id])
+
+    def evaluate_sat_change(self, sat_id: int, replaced: Optional["SERoute"], se_profile: Tuple[float, float, float, float],
+                            delivery: float, pickup: float) -> Tuple[bool, float, float, float]:
+        """
+        Đánh giá KHÔNG thay đổi tuyến (không lập lịch lại, không đặt thời điểm xuất phát cho tuyến SE) lịch trình FE
+        khi các tuyến SE tại sat_id thay đổi: tuyến replaced có profile xuất phát mới se_profile (replaced = None:
+        thêm một tuyến SE mới với profile đó), tải giao / nhận của vệ tinh tăng delivery / pickup.
+        Thứ tự vệ tinh và thời điểm rời mỗi vệ tinh theo mô hình profile của satellite_order.
+        Trả về (khả thi, tổng quãng đường mới, tổng thời gian di chuyển mới, thời điểm về depot mới).
+        """
+        problem = self.problem
+        capacity = problem.fe_vehicle_capacity + 1e-6
+        if self.total_load_delivery + delivery > capacity: return False, 0.0, 0.0, float('inf')
+        se_routes_by_sat = self.se_routes_by_sat
+        sat_profiles = {s: self._merge_profiles(r.departure_profile() for r in routes) for s, routes in se_routes_by_sat.items() if s != sat_id}
+        at_sat = [se_profile if r is replaced else r.departure_profile() for r in se_routes_by_sat.get(sat_id, ())]
+        if replaced is None: at_sat.append(se_profile)
+        sat_profiles[sat_id] = self._merge_profiles(at_sat)
+        sat_loads = dict(self.sat_loads)
+        old_delivery, old_pickup = sat_loads.get(sat_id, (0.0, 0.0))
+        sat_loads[sat_id] = (old_delivery + delivery, old_pickup + pickup)
+        order = self._order_from_profiles(sat_profiles, sat_loads)
+        time_rows, dist_rows, depot_id = problem.time_rows, problem.dist_rows, problem.depot.id
+        current_time, current_load, last_node_id = 0.0, self.total_load_delivery + delivery, depot_id
+        deadline = float('inf')
+        for s in order:
+            latest_arrival, duration, earliest_end, min_deadline = sat_profiles[s]
+            arrival = current_time + time_rows[last_node_id][s]
+            if arrival > latest_arrival + 1e-6: return False, 0.0, 0.0, float('inf')
+            current_load += sat_loads[s][1] - sat_loads[s][0]
+            if current_load > capacity: return False, 0.0, 0.0, float('inf')
+            current_time = max(arrival + duration, earliest_end)
+            deadline = min(deadline, min_deadline); last_node_id = s
+        arrival_at_depot = current_time + time_rows[last_node_id][depot_id]
+        if arrival_at_depot > deadline + 1e-6: return False, 0.0, 0.0, float('inf')
+        path = [depot_id, *order, depot_id]
+        return (True, sum(dist_rows[a][b] for a, b in zip(path, path[1:])), sum(time_rows[a][b] for a, b in zip(path, path[1:])), arrival_at_depot)
 
     def __repr__(self) -> str:
         if not self.schedule: return "--- Empty FERoute ---"
-        path_nodes = [self.schedule[0]['node_id']]
-        for event in self.schedule[1:]:
-            if event['node_id'] != path_nodes[-1]: path_nodes.append(event['node_id'])
-        path_str = " -> ".join(map(str, path_nodes))
+        path_str = " -> ".join(map(str, self._path))
         deadline_str = f"Route Deadline: {self.route_deadline:.2f}" if self.route_deadline != float('inf') else "No Deadline"
         header_str = (f"--- FERoute (Cost: {self.total_dist:.2f}, Time: {self.total_time:.2f}) --- {deadline_str}")
         lines = [header_str, f"Path: {path_str}"]
@@ -36,81 +294,301 @@ class FERoute:
         lines.append(tbl_header)
         lines.append("  " + "-" * len(tbl_header))
         for event in self.schedule:
-            lines.append(f"  {event['activity']:<15}| {event['node_id']:<6}| {event['load_after']:>12.2f}| "
-                         f"{event['arrival_time']:>9.2f}| {event['departure_time']:>11.2f}")
+            lines.append(f"  {event.activity:<15}| {event.node_id:<6}| {event.load_after:>12.2f}| "
+                         f"{event.arrival_time:>9.2f}| {event.departure_time:>11.2f}")
         return "\n".join(lines)
 
-    def add_serviced_se_route(self, se_route: "SERoute"): self.serviced_se_routes.add(se_route)
-    def remove_serviced_se_route(self, se_route: "SERoute"): self.serviced_se_routes.discard(se_route)
+    def add_serviced_se_route(self, se_route: "SERoute"):
+        if se_route in self.serviced_se_routes: return
+        sat_id = se_route.satellite.id
+        self.serviced_se_routes.add(se_route)
+        self.se_routes_by_sat = {**self.se_routes_by_sat, sat_id: self.se_routes_by_sat.get(sat_id, ()) + (se_route,)}
+        self._on_sat_changed(sat_id)
+
+    def remove_serviced_se_route(self, se_route: "SERoute"):
+        if se_route not in self.serviced_se_routes: return
+        sat_id = se_route.satellite.id
+        self.serviced_se_routes.discard(se_route)
+        remaining = tuple(r for r in self.se_routes_by_sat[sat_id] if r is not se_route)
+        self.se_routes_by_sat = {k: v for k, v in self.se_routes_by_sat.items() if k != sat_id}
+        if remaining: self.se_routes_by_sat[sat_id] = remaining
+        self._on_sat_changed(sat_id)
+
+    def _on_sat_changed(self, sat_id: int):
+        # Tải cache đang đúng thì chỉ cập nhật vệ tinh vừa đổi; ngược lại để _ensure_loads tính lại toàn bộ khi đọc.
+        loads_valid = not self._loads_dirty
+        self.mark_dirty()
+        if loads_valid: self._loads_dirty = False; self._update_loads((sat_id,))
     
-    def calculate_route_properties(self):
-        if len(self.schedule) < 2: 
+    def pickup_event_index(self, sat_id: int) -> Optional[int]:
+        """Chỉ số sự kiện LOAD_PICKUP của vệ tinh sat_id trong schedule (sự kiện UNLOAD_DELIV đứng ngay trước), hoặc None."""
+        path = self.path
+        try: return 2 * path.index(sat_id, 1, len(path) - 1)
+        except ValueError: return None
+
+    def calculate_route_properties(self, route_deadline: Optional[float] = None):
+        schedule, path = self._schedule, self._path
+        if len(schedule) < 2: 
             self.total_dist, self.total_time, self.total_travel_time, self.route_deadline = 0.0, 0.0, 0.0, float('inf')
             return
-        self.total_dist = 0.0
-        self.total_travel_time = 0.0
-        path_nodes = [self.schedule[0]['node_id']]
-        [path_nodes.append(e['node_id']) for e in self.schedule[1:] if e['node_id'] != path_nodes[-1]]
-        for i in range(len(path_nodes) - 1): 
-            self.total_dist += self.problem.get_distance(path_nodes[i], path_nodes[i+1])
-            self.total_travel_time += self.problem.get_travel_time(path_nodes[i], path_nodes[i+1])
-        self.total_time = self.schedule[-1]['arrival_time'] - self.schedule[0]['departure_time']
-        deadlines = {c.deadline for se in self.serviced_se_routes for c in se.get_customers() if hasattr(c, 'deadline')}
-        self.route_deadline = min(deadlines) if deadlines else float('inf')
+        dist_rows, time_rows = self.problem.dist_rows, self.problem.time_rows
+        self.total_dist = sum(dist_rows[a][b] for a, b in zip(path, path[1:]))
+        self.total_travel_time = sum(time_rows[a][b] for a, b in zip(path, path[1:]))
+        self.total_time = schedule[-1].arrival_time - schedule[0].departure_time
+        if route_deadline is None:
+            node_deadline = self.problem.node_deadline
+            route_deadline = min((node_deadline[nid] for se in self.serviced_se_routes for nid in se.nodes_id[1:-1]), default=float('inf'))
+        self.route_deadline = route_deadline
 
     def backup(self) -> RouteMemento: return RouteMemento(self)
     def restore(self, memento: RouteMemento):
         self.serviced_se_routes = memento.serviced_se_routes
-        self.schedule = memento.schedule
+        self._schedule = memento.schedule
+        self._path = memento.path
+        self._schedule_dirty = memento.schedule_dirty
+        self._sat_schedule_cache = memento.sat_schedule_cache
+        self.se_routes_by_sat = memento.se_routes_by_sat
+        self._sat_loads, self._total_load_delivery, self._total_load_pickup, self._loads_dirty = memento.fe_loads
+        self.version = memento.version
         self.total_dist = memento.total_dist
         self.total_time = memento.total_time
         self.total_travel_time = memento.total_travel_time
         self.route_deadline = memento.route_deadline
 
+    # <<< STAMP CHO NHẬT KÝ HOÀN TÁC (xem ChangeContext) >>>
+    # Các thuộc tính dùng chung được lưu theo tham chiếu (xem bất biến ở RouteMemento); tập serviced_se_routes
+    # được khôi phục bằng các thao tác nối / tách ngược trong nhật ký.
+    def stamp(self) -> tuple:
+        return (self.version, self._schedule, self._path, self._schedule_dirty, self._sat_schedule_cache, self.se_routes_by_sat,
+                (self._sat_loads, self._total_load_delivery, self._total_load_pickup, self._loads_dirty),
+                self.total_dist, self.total_time, self.total_travel_time, self.route_deadline)
+
+    def restore_stamp(self, stamp: tuple):
+        if self.version == stamp[0]: return
+        (self.version, self._schedule, self._path, self._schedule_dirty, self._sat_schedule_cache, self.se_routes_by_sat, fe_loads,
+         self.total_dist, self.total_time, self.total_travel_time, self.route_deadline) = stamp
+        self._sat_loads, self._total_load_delivery, self._total_load_pickup, self._loads_dirty = fe_loads
+
+
+class SERoute(_TrackedRouteTotals):
+    # <<< LỊCH TRÌNH LƯU DẠNG MẢNG array('d') SONG SONG VỚI nodes_id (CHỈ SỐ = VỊ TRÍ TRÊN TUYẾN) >>>
+    # Sao lưu / khôi phục chỉ là vài lần sao chép bộ đệm liên tục thay vì sao chép dict.
+    # Lịch trình và profile tải được tính lười: thay đổi tuyến chỉ đánh dấu "dirty" và nhận version mới,
+    # việc tính lại diễn ra một lần khi đọc lần đầu (qua các property cùng tên không có dấu _).
+    __slots__ = ('problem', 'satellite', 'nodes_id', 'serving_fe_routes', '_owner',
+                 '_service_start_times', '_waiting_times', '_forward_time_slacks', '_suffix_waiting_times', '_latest_start_times',
+                 '_no_wait_duration', '_earliest_end', '_min_deadline',
+                 '_total_dist', '_total_travel_time', 'total_load_pickup', 'total_load_delivery',
+                 '_load_profile', '_prefix_max_load', '_suffix_max_load',
+                 '_schedule_dirty', '_load_profile_dirty', 'version')
 
-class SERoute:
     def __init__(self, satellite: "Satellite", problem: "ProblemInstance", start_time: float = 0.0):
         self.problem = problem
+        self._owner: Optional[Solution] = None
         self.satellite = satellite
         self.nodes_id: List[int] = [satellite.dist_id, satellite.coll_id]
         self.serving_fe_routes: Set[FERoute] = set()
-        self.service_start_times: Dict[int, float] = {satellite.dist_id: start_time}
-        self.waiting_times: Dict[int, float] = {satellite.dist_id: 0.0}
-        self.forward_time_slacks: Dict[int, float] = {satellite.dist_id: float('inf')}
-        self.total_dist: float = 0.0
-        self.total_travel_time: float = 0.0
+        # service_start_times[0] là thời điểm xe SE rời vệ tinh (được đặt khi lập lịch tuyến FE, xem set_start_time).
+        self._service_start_times = array('d', (start_time, 0.0))
+        self._waiting_times = array('d', (0.0, 0.0))
+        self._forward_time_slacks = array('d', (float('inf'), float('inf')))
+        # Tổng thời gian chờ tại các node phía sau một vị trí (không tính chính vị trí đó), dùng cho kiểm tra chèn O(1).
+        self._suffix_waiting_times = array('d', (0.0, 0.0))
+        # Thời điểm bắt đầu muộn nhất tại mỗi vị trí để mọi node phía sau vẫn đúng cửa sổ thời gian (duyệt ngược).
+        self._latest_start_times = array('d', (float('inf'), float('inf')))
+        # Profile xuất phát, không phụ thuộc thời điểm rời vệ tinh (xem departure_profile).
+        self._no_wait_duration: float = 0.0
+        self._earliest_end: float = 0.0
+        self._min_deadline: float = float('inf')
+        self._total_dist: float = 0.0
+        self._total_travel_time: float = 0.0
         self.total_load_pickup: float = 0.0
         self.total_load_delivery: float = 0.0
-        self.calculate_full_schedule_and_slacks()
+        # Tải trọng sau mỗi vị trí trên tuyến và max tiền tố / hậu tố của nó (xem _update_load_profile).
+        self._load_profile: List[float] = []
+        self._prefix_max_load: List[float] = []
+        self._suffix_max_load: List[float] = []
+        self._schedule_dirty = True
+        self._load_profile_dirty = True
+        self.version = next(_route_versions)
+
+    # <<< TRUY CẬP LỊCH TRÌNH / PROFILE TẢI: TÍNH LẠI KHI ĐỌC LẦN ĐẦU SAU MỘT THAY ĐỔI >>>
+    @property
+    def service_start_times(self) -> array: self._ensure_schedule(); return self._service_start_times
+    @property
+    def waiting_times(self) -> array: self._ensure_schedule(); return self._waiting_times
+    @property
+    def forward_time_slacks(self) -> array: self._ensure_schedule(); return self._forward_time_slacks
+    @property
+    def suffix_waiting_times(self) -> array: self._ensure_schedule(); return self._suffix_waiting_times
+    @property
+    def latest_start_times(self) -> array: self._ensure_schedule(); return self._latest_start_times
+    @property
+    def load_profile(self) -> List[float]: self._ensure_load_profile(); return self._load_profile
+    @property
+    def prefix_max_load(self) -> List[float]: self._ensure_load_profile(); return self._prefix_max_load
+    @property
+    def suffix_max_load(self) -> List[float]: self._ensure_load_profile(); return self._suffix_max_load
+
+    def _ensure_schedule(self):
+        if self._schedule_dirty: self.calculate_full_schedule_and_slacks()
+    def _ensure_load_profile(self):
+        if self._load_profile_dirty: self._update_load_profile()
+
+    def _mark_modified(self):
+        """Đánh dấu tuyến đã thay đổi: lịch trình và profile tải sẽ được tính lại khi đọc, các tuyến FE phục vụ cũng cần lập lịch lại."""
+        self._schedule_dirty = self._load_profile_dirty = True
+        self.version = next(_route_versions)
+        for fe_route in self.serving_fe_routes: fe_route.mark_dirty()
+
+    def set_start_time(self, start_time: float):
+        """Đặt thời điểm xe SE rời vệ tinh; lịch trình chỉ cần tính lại khi giá trị thực sự thay đổi."""
+        if self._service_start_times[0] != start_time:
+            # Ghi stamp vào nhật ký hoàn tác đang mở (nếu có) trước khi đổi: chỉ các tuyến SE thực sự bị dời lịch được ghi.
+            owner = self._owner
+            if owner is not None and owner._journal is not None: owner._journal.stamp_route(self)
+            self._service_start_times[0] = start_time
+            self._schedule_dirty = True
+            self.version = next(_route_versions)
+
+    def _update_load_profile(self):
+        """
+        load_profile[i]: tải trọng xe SE khi rời vị trí i (vị trí 0 = rời vệ tinh với toàn bộ hàng giao).
+        prefix_max_load / suffix_max_load: max của load_profile trên [0..i] / [i..n-1], cho phép kiểm tra
+        tải trọng khi chèn một khách hàng trong O(1) (xem can_insert_load).
+        """
+        signed_demand, phys = self.problem.node_signed_demand, self.problem.route_node_phys
+        self._load_profile = list(accumulate((signed_demand[phys[nid]] for nid in self.nodes_id[1:]), initial=self.total_load_delivery))
+        self._prefix_max_load = list(accumulate(self._load_profile, max))
+        self._suffix_max_load = list(accumulate(reversed(self._load_profile), max))[::-1]
+        self._load_profile_dirty = False
+
+    def can_insert_load(self, customer_id: int, pos: int) -> bool:
+        """
+        Kiểm tra O(1) tải trọng khi chèn khách hàng vào vị trí pos:
+        - giao hàng d: mọi tải trọng trước vị trí chèn tăng d, phía sau không đổi;
+        - lấy hàng d: tải trọng từ vị trí chèn trở đi tăng d, phía trước không đổi.
+        """
+        if self._load_profile_dirty: self._update_load_profile()
+        capacity = self.problem.se_vehicle_capacity + 1e-6
+        demand = self.problem.node_demand[customer_id]
+        if self.problem.node_kind[customer_id] == KIND_DELIVERY:
+            return self._prefix_max_load[pos-1] + demand <= capacity and self._suffix_max_load[pos] <= capacity
+        return max(self._prefix_max_load[pos-1], self._load_profile[pos-1] + demand, self._suffix_max_load[pos] + demand) <= capacity
 
     def calculate_full_schedule_and_slacks(self):
-        for i in range(len(self.nodes_id) - 1):
-            prev_id, curr_id = self.nodes_id[i], self.nodes_id[i+1]
-            prev_obj = self.problem.node_objects[prev_id % self.problem.total_nodes]
-            curr_obj = self.problem.node_objects[curr_id % self.problem.total_nodes]
-            st_prev = prev_obj.service_time if prev_obj.type != 'Satellite' else 0.0
-            departure_prev = self.service_start_times.get(prev_id, 0.0) + st_prev
-            arrival_curr = departure_prev + self.problem.get_travel_time(prev_obj.id, curr_obj.id)
-            start_service = max(arrival_curr, getattr(curr_obj, 'ready_time', 0))
-            self.service_start_times[curr_id] = start_service
-            self.waiting_times[curr_id] = start_service - arrival_curr
-        n = len(self.nodes_id)
-        if self.nodes_id: self.forward_time_slacks.setdefault(self.nodes_id[n-1], float('inf'))
+        problem = self.problem
+        phys = problem.route_node_phys
+        time_rows, ready_time, due_time_of = problem.time_rows, problem.node_ready_time, problem.node_due_time
+        service_time, node_deadline = problem.node_effective_service_time, problem.node_deadline
+        self._schedule_dirty = False
+        nodes_id, start_times, waiting_times, slacks = self.nodes_id, self._service_start_times, self._waiting_times, self._forward_time_slacks
+        suffix_waits, latest_starts = self._suffix_waiting_times, self._latest_start_times
+        n = len(nodes_id)
+        prev_phys = phys[nodes_id[0]]
+        for i in range(1, n):
+            curr_phys = phys[nodes_id[i]]
+            arrival_curr = start_times[i-1] + service_time[prev_phys] + time_rows[prev_phys][curr_phys]
+            start_service = max(arrival_curr, ready_time[curr_phys])
+            start_times[i] = start_service
+            waiting_times[i] = start_service - arrival_curr
+            prev_phys = curr_phys
+        # <<< FORWARD TIME SLACK: LƯỢNG TỐI ĐA CÓ THỂ ĐẨY LÙI THỜI ĐIỂM BẮT ĐẦU TẠI NODE MÀ KHÔNG VI PHẠM CỬA SỔ THỜI GIAN >>>
+        # slack_i = min(due_i - start_i, wait_{i+1} + slack_{i+1}): thời gian chờ ở node sau hấp thụ được độ trễ.
+        # latest_i = min(due_i, latest_{i+1} - service_i - t(i, i+1)).
+        # tail_i: thời gian từ lúc bắt đầu phục vụ tại i tới node thu gom nếu không phải chờ;
+        # earliest_end = max_i(ready_i + tail_i) là thời điểm kết thúc sớm nhất do cửa sổ thời gian.
+        succ_phys = phys[nodes_id[n-1]]
+        slacks[n-1] = float('inf'); suffix_waits[n-1] = 0.0; latest_starts[n-1] = due_time_of[succ_phys]
+        tail = 0.0; earliest_end = ready_time[succ_phys]; min_deadline = node_deadline[succ_phys]
         for i in range(n - 2, -1, -1):
-            node_id, succ_id = self.nodes_id[i], self.nodes_id[i+1]
-            node_obj = self.problem.node_objects[node_id % self.problem.total_nodes]
-            due_time = getattr(node_obj, 'due_time', float('inf'))
-            st_node = node_obj.service_time if node_obj.type != 'Satellite' else 0.0
-            departure_node = self.service_start_times.get(node_id, 0.0) + st_node
-            arrival_succ = self.service_start_times.get(succ_id, 0.0) - self.waiting_times.get(succ_id, 0.0)
-            slack_between = arrival_succ - departure_node
-            self.forward_time_slacks[node_id] = min(self.forward_time_slacks.get(succ_id, float('inf')) + slack_between, due_time - self.service_start_times.get(node_id, 0.0))
+            node_phys = phys[nodes_id[i]]
+            succ_wait = waiting_times[i+1]
+            suffix_waits[i] = suffix_waits[i+1] + succ_wait
+            slacks[i] = min(slacks[i+1] + succ_wait, due_time_of[node_phys] - start_times[i])
+            latest_starts[i] = min(due_time_of[node_phys], latest_starts[i+1] - service_time[node_phys] - time_rows[node_phys][succ_phys])
+            tail += service_time[node_phys] + time_rows[node_phys][succ_phys]
+            if ready_time[node_phys] + tail > earliest_end: earliest_end = ready_time[node_phys] + tail
+            if node_deadline[node_phys] < min_deadline: min_deadline = node_deadline[node_phys]
+            succ_phys = node_phys
+        self._no_wait_duration, self._earliest_end, self._min_deadline = tail, earliest_end, min_deadline
+
+    def departure_profile(self) -> Tuple[float, float, float, float]:
+        """
+        (thời điểm rời vệ tinh muộn nhất, thời lượng tuyến khi không phải chờ, thời điểm kết thúc sớm nhất,
+        deadline nhỏ nhất của khách hàng). Xuất phát lúc t không muộn hơn phần tử đầu thì mọi khách hàng đúng
+        cửa sổ thời gian và tuyến kết thúc lúc max(t + thời lượng, thời điểm kết thúc sớm nhất).
+        Không phụ thuộc thời điểm xuất phát hiện tại; dùng để sắp thứ tự vệ tinh của tuyến FE.
+        """
+        if self._schedule_dirty: self.calculate_full_schedule_and_slacks()
+        return self._latest_start_times[0], self._no_wait_duration, self._earliest_end, self._min_deadline
+
+    def departure_profile_with_insertion(self, customer_id: int, pos: int) -> Tuple[float, float, float, float]:
+        """
+        departure_profile() của tuyến sau khi chèn customer_id vào vị trí pos, tính bằng một lượt duyệt ngược trên
+        dãy node giả định mà KHÔNG thay đổi tuyến (O(n)).
+        """
+        problem = self.problem
+        phys, time_rows, ready_time, due_time_of = problem.route_node_phys, problem.time_rows, problem.node_ready_time, problem.node_due_time
+        service_time, node_deadline = problem.node_effective_service_time, problem.node_deadline
+        nodes = [phys[nid] for nid in self.nodes_id]; nodes.insert(pos, customer_id)
+        succ_phys = nodes[-1]
+        latest = due_time_of[succ_phys]; tail = 0.0; earliest_end = ready_time[succ_phys]; min_deadline = node_deadline[succ_phys]
+        for i in range(len(nodes) - 2, -1, -1):
+            node_phys = nodes[i]
+            latest = min(due_time_of[node_phys], latest - service_time[node_phys] - time_rows[node_phys][succ_phys])
+            tail += service_time[node_phys] + time_rows[node_phys][succ_phys]
+            if ready_time[node_phys] + tail > earliest_end: earliest_end = ready_time[node_phys] + tail
+            if node_deadline[node_phys] < min_deadline: min_deadline = node_deadline[node_phys]
+            succ_phys = node_phys
+        return latest, tail, earliest_end, min_deadline
+
+    def get_service_start_time(self, node_id: int, default: Optional[float] = None) -> Optional[float]:
+        """Thời điểm bắt đầu phục vụ tại node_id (tra theo vị trí trong nodes_id), hoặc default nếu node không thuộc tuyến."""
+        try: return self.service_start_times[self.nodes_id.index(node_id)]
+        except ValueError: return default
+
+    def evaluate_insertion(self, customer_id: int, pos: int) -> Optional[float]:
+        """
+        Kiểm tra O(1) kiểu push-forward (Savelsbergh) việc chèn khách hàng vào vị trí pos, dựa trên lịch trình
+        và slack hiện tại, KHÔNG thay đổi tuyến. Trả về thời điểm kết thúc mới của tuyến (tại node thu gom),
+        hoặc None nếu vi phạm cửa sổ thời gian của khách hàng mới hay của một khách hàng phía sau.
+        """
+        problem = self.problem
+        phys, time_rows, service_time = problem.route_node_phys, problem.time_rows, problem.node_effective_service_time
+        prev_phys, succ_phys = phys[self.nodes_id[pos-1]], phys[self.nodes_id[pos]]
+        if self._schedule_dirty: self.calculate_full_schedule_and_slacks()
+        start_times = self._service_start_times
+        arrival = start_times[pos-1] + service_time[prev_phys] + time_rows[prev_phys][customer_id]
+        start = max(arrival, problem.node_ready_time[customer_id])
+        if start > problem.node_due_time[customer_id] + 1e-6: return None
+        # Độ trễ tại node kế tiếp; các khoảng chờ phía sau lần lượt hấp thụ độ trễ này.
+        push = max(0.0, start + service_time[customer_id] + time_rows[customer_id][succ_phys] - start_times[pos])
+        if push > self._forward_time_slacks[pos] + 1e-6: return None
+        end_delay = max(0.0, push - self._suffix_waiting_times[pos])
+        return start_times[-1] + end_delay
+
+    def evaluate_removal(self, pos: int) -> Optional[Tuple[float, float]]:
+        """
+        Đánh giá O(1) việc xóa khách hàng ở vị trí pos mà không thay đổi tuyến. Trả về (quãng đường giảm,
+        thời gian di chuyển giảm) của tuyến, hoặc None nếu thời điểm bắt đầu mới tại node kế tiếp vượt quá
+        latest_start_times (lịch trình phía sau vi phạm cửa sổ thời gian).
+        """
+        problem = self.problem
+        phys, dist_rows, time_rows = problem.route_node_phys, problem.dist_rows, problem.time_rows
+        prev_phys, cid, succ_phys = phys[self.nodes_id[pos-1]], self.nodes_id[pos], phys[self.nodes_id[pos+1]]
+        if self._schedule_dirty: self.calculate_full_schedule_and_slacks()
+        arrival_succ = self._service_start_times[pos-1] + problem.node_effective_service_time[prev_phys] + time_rows[prev_phys][succ_phys]
+        if max(arrival_succ, problem.node_ready_time[succ_phys]) > self._latest_start_times[pos+1] + 1e-6: return None
+        dist_gain = dist_rows[prev_phys][cid] + dist_rows[cid][succ_phys] - dist_rows[prev_phys][succ_phys]
+        time_gain = time_rows[prev_phys][cid] + time_rows[cid][succ_phys] - time_rows[prev_phys][succ_phys]
+        return dist_gain, time_gain
 
     def __repr__(self) -> str:
-        path_ids = [nid % self.problem.total_nodes for nid in self.nodes_id]
+        path_ids = [self.problem.route_node_phys[nid] for nid in self.nodes_id]
         path_str = " -> ".join(map(str, path_ids))
-        start_time_val = self.service_start_times.get(self.nodes_id[0], 0.0)
-        end_time_val = self.service_start_times.get(self.nodes_id[-1], 0.0)
+        start_time_val = self.service_start_times[0]
+        end_time_val = self.service_start_times[-1]
         operating_time = end_time_val - start_time_val if len(self.nodes_id) > 1 else 0.0
         header_str = (f"--- SERoute for Satellite {self.satellite.id} (Cost: {self.total_dist:.2f}, Time: {operating_time:.2f}) ---")
         lines = [header_str, f"Path: {path_str}"]
@@ -119,42 +597,73 @@ class SERoute:
         current_load = self.total_load_delivery
         dep_start = start_time_val
         lines.append(f"  {str(self.satellite.id) + ' (Dist)':<10}| {'Satellite':<18}| {-self.total_load_delivery:>8.2f}| {current_load:>12.2f}| {start_time_val:>9.2f}| {start_time_val:>9.2f}| {dep_start:>11.2f}| {'N/A':>10}")
-        for node_id in self.nodes_id[1:-1]:
+        for pos, node_id in enumerate(self.nodes_id[1:-1], 1):
             customer = self.problem.node_objects[node_id]
             demand_str, deadline_str = "", "N/A"
             if customer.type == 'DeliveryCustomer': current_load -= customer.demand; demand_str = f"{-customer.demand:.2f}"
             else: current_load += customer.demand; demand_str = f"+{customer.demand:.2f}"; 
             if hasattr(customer, 'deadline'): deadline_str = f"{customer.deadline:.2f}"
-            arrival = self.service_start_times.get(node_id, 0.0) - self.waiting_times.get(node_id, 0.0)
-            start_svc = self.service_start_times.get(node_id, 0.0)
+            arrival = self.service_start_times[pos] - self.waiting_times[pos]
+            start_svc = self.service_start_times[pos]
             departure = start_svc + customer.service_time
             lines.append(f"  {customer.id:<10}| {customer.type:<18}| {demand_str:>8}| {current_load:>12.2f}| {arrival:>9.2f}| {start_svc:>9.2f}| {departure:>11.2f}| {deadline_str:>10}")
         final_load = current_load
-        arrival_end = self.service_start_times.get(self.nodes_id[-1], 0.0) - self.waiting_times.get(self.nodes_id[-1], 0.0)
+        arrival_end = self.service_start_times[-1] - self.waiting_times[-1]
         dep_end = end_time_val
         lines.append(f"  {str(self.satellite.id) + ' (Coll)':<10}| {'Satellite':<18}| {self.total_load_pickup:>+8.2f}| {final_load:>12.2f}| {arrival_end:>9.2f}| {end_time_val:>9.2f}| {dep_end:>11.2f}| {'N/A':>10}")
         return "\n".join(lines)
     
     def insert_customer_at_pos(self, customer: "Customer", pos: int):
-        prev_obj = self.problem.node_objects[self.nodes_id[pos-1] % self.problem.total_nodes]; succ_obj = self.problem.node_objects[self.nodes_id[pos] % self.problem.total_nodes]
-        dist_change = (self.problem.get_distance(prev_obj.id, customer.id) + self.problem.get_distance(customer.id, succ_obj.id) - self.problem.get_distance(prev_obj.id, succ_obj.id))
-        time_change = (self.problem.get_travel_time(prev_obj.id, customer.id) + self.problem.get_travel_time(customer.id, succ_obj.id) - self.problem.get_travel_time(prev_obj.id, succ_obj.id))
-        self.nodes_id.insert(pos, customer.id); self.total_dist += dist_change; self.total_travel_time += time_change
-        if customer.type == 'DeliveryCustomer': self.total_load_delivery += customer.demand
-        else: self.total_load_pickup += customer.demand
-        self.calculate_full_schedule_and_slacks()
+        problem = self.problem
+        prev_phys = problem.route_node_phys[self.nodes_id[pos-1]]; succ_phys = problem.route_node_phys[self.nodes_id[pos]]; cid = customer.id
+        dist_row_prev, time_row_prev = problem.dist_rows[prev_phys], problem.time_rows[prev_phys]
+        dist_change = dist_row_prev[cid] + problem.dist_rows[cid][succ_phys] - dist_row_prev[succ_phys]
+        time_change = time_row_prev[cid] + problem.time_rows[cid][succ_phys] - time_row_prev[succ_phys]
+        self.nodes_id.insert(pos, cid); self.total_dist += dist_change; self.total_travel_time += time_change
+        for schedule_array in self._schedule_arrays(): schedule_array.insert(pos, 0.0)
+        if problem.node_kind[cid] == KIND_DELIVERY: self.total_load_delivery -= problem.node_signed_demand[cid]
+        else: self.total_load_pickup += problem.node_signed_demand[cid]
+        self._mark_modified()
         
     def remove_customer(self, customer: "Customer"):
         if customer.id not in self.nodes_id: return
-        pos = self.nodes_id.index(customer.id)
-        prev_obj = self.problem.node_objects[self.nodes_id[pos-1] % self.problem.total_nodes]; succ_obj = self.problem.node_objects[self.nodes_id[pos+1] % self.problem.total_nodes]
-        dist_change = (self.problem.get_distance(prev_obj.id, customer.id) + self.problem.get_distance(customer.id, succ_obj.id) - self.problem.get_distance(prev_obj.id, succ_obj.id))
-        time_change = (self.problem.get_travel_time(prev_obj.id, customer.id) + self.problem.get_travel_time(customer.id, succ_obj.id) - self.problem.get_travel_time(prev_obj.id, succ_obj.id))
+        problem = self.problem
+        pos = self.nodes_id.index(customer.id); cid = customer.id
+        prev_phys = problem.route_node_phys[self.nodes_id[pos-1]]; succ_phys = problem.route_node_phys[self.nodes_id[pos+1]]
+        dist_row_prev, time_row_prev = problem.dist_rows[prev_phys], problem.time_rows[prev_phys]
+        dist_change = dist_row_prev[cid] + problem.dist_rows[cid][succ_phys] - dist_row_prev[succ_phys]
+        time_change = time_row_prev[cid] + problem.time_rows[cid][succ_phys] - time_row_prev[succ_phys]
         self.total_dist -= dist_change; self.total_travel_time -= time_change; self.nodes_id.pop(pos)
-        if customer.type == 'DeliveryCustomer': self.total_load_delivery -= customer.demand
-        else: self.total_load_pickup -= customer.demand
-        self.calculate_full_schedule_and_slacks()
+        for schedule_array in self._schedule_arrays(): del schedule_array[pos]
+        if problem.node_kind[cid] == KIND_DELIVERY: self.total_load_delivery += problem.node_signed_demand[cid]
+        else: self.total_load_pickup -= problem.node_signed_demand[cid]
+        self._mark_modified()
         
+    def remove_customers(self, customer_ids: Set[int]) -> List[int]:
+        """
+        Xóa nhiều khách hàng khỏi tuyến trong một lượt: lọc nodes_id một lần rồi tính lại quãng đường,
+        tải trọng và lịch trình một lần (thay vì remove_customer cho từng khách hàng, mỗi lần O(n)).
+        Trả về id các khách hàng thực sự bị xóa.
+        """
+        removed_ids = [nid for nid in self.nodes_id[1:-1] if nid in customer_ids]
+        if not removed_ids: return removed_ids
+        problem = self.problem
+        phys, dist_rows, time_rows = problem.route_node_phys, problem.dist_rows, problem.time_rows
+        self.nodes_id[1:-1] = [nid for nid in self.nodes_id[1:-1] if nid not in customer_ids]
+        path = [phys[nid] for nid in self.nodes_id]
+        self.total_dist = sum(dist_rows[a][b] for a, b in zip(path, path[1:]))
+        self.total_travel_time = sum(time_rows[a][b] for a, b in zip(path, path[1:]))
+        for cid in removed_ids:
+            if problem.node_kind[cid] == KIND_DELIVERY: self.total_load_delivery += problem.node_signed_demand[cid]
+            else: self.total_load_pickup -= problem.node_signed_demand[cid]
+        # Vị trí 0 (thời điểm rời vệ tinh) giữ nguyên, các vị trí còn lại được tính lại khi đọc lịch trình.
+        for schedule_array in self._schedule_arrays(): del schedule_array[len(self.nodes_id):]
+        self._mark_modified()
+        return removed_ids
+
+    def _schedule_arrays(self) -> Tuple[array, ...]:
+        return (self._service_start_times, self._waiting_times, self._forward_time_slacks, self._suffix_waiting_times, self._latest_start_times)
+
     def get_customers(self) -> List["Customer"]: return [self.problem.node_objects[nid] for nid in self.nodes_id[1:-1]]
     def backup(self) -> RouteMemento: return RouteMemento(self)
     def restore(self, memento: RouteMemento):
@@ -163,10 +672,47 @@ class SERoute:
         self.total_travel_time = memento.total_travel_time
         self.total_load_pickup = memento.total_load_pickup
         self.total_load_delivery = memento.total_load_delivery
-        self.service_start_times = memento.service_start_times
-        self.waiting_times = memento.waiting_times
-        self.forward_time_slacks = memento.forward_time_slacks
+        self._service_start_times = memento.service_start_times
+        self._waiting_times = memento.waiting_times
+        self._forward_time_slacks = memento.forward_time_slacks
+        self._suffix_waiting_times = memento.suffix_waiting_times
+        self._latest_start_times = memento.latest_start_times
+        self._no_wait_duration, self._earliest_end, self._min_deadline = memento.departure_profile
+        self._load_profile = memento.load_profile
+        self._prefix_max_load = memento.prefix_max_load
+        self._suffix_max_load = memento.suffix_max_load
+        self._schedule_dirty = memento.schedule_dirty
+        self._load_profile_dirty = memento.load_profile_dirty
         self.serving_fe_routes = memento.serving_fe_routes
+        # Nội dung quay về đúng trạng thái đã sao lưu nên lấy lại version tương ứng (các cache theo version vẫn đúng).
+        self.version = memento.version
+
+    # <<< STAMP VÀ THAO TÁC NGƯỢC CHO NHẬT KÝ HOÀN TÁC (xem ChangeContext) >>>
+    # nodes_id được khôi phục bằng undo_insert / undo_remove; tổng, tải, thời điểm xuất phát và version lấy lại từ stamp,
+    # các mảng lịch trình được tính lại khi đọc lần đầu.
+    def stamp(self) -> tuple:
+        return (self.version, self.total_dist, self.total_travel_time, self.total_load_pickup, self.total_load_delivery,
+                self._service_start_times[0], self._load_profile, self._prefix_max_load, self._suffix_max_load, self._load_profile_dirty)
+
+    def restore_stamp(self, stamp: tuple):
+        if self.version == stamp[0]: return
+        (self.version, self.total_dist, self.total_travel_time, self.total_load_pickup, self.total_load_delivery, start_time,
+         self._load_profile, self._prefix_max_load, self._suffix_max_load, self._load_profile_dirty) = stamp
+        self._service_start_times[0] = start_time
+        self._schedule_dirty = True
+
+    def undo_insert(self, pos: int) -> int:
+        """Bỏ node ở vị trí pos (đảo ngược insert_customer_at_pos), trả về id của node."""
+        cid = self.nodes_id.pop(pos)
+        for schedule_array in self._schedule_arrays(): del schedule_array[pos]
+        self._schedule_dirty = self._load_profile_dirty = True
+        return cid
+
+    def undo_remove(self, removed: List[Tuple[int, int]]):
+        """Chèn lại các (vị trí, id) đã bị xóa, theo vị trí tăng dần (đảo ngược remove_customers)."""
+        for pos, cid in removed: self.nodes_id.insert(pos, cid)
+        for schedule_array in self._schedule_arrays(): schedule_array.extend([0.0] * (len(self.nodes_id) - len(schedule_array)))
+        self._schedule_dirty = self._load_profile_dirty = True
 
 class Solution:
     def __init__(self, problem: "ProblemInstance"):
@@ -175,33 +721,103 @@ class Solution:
         self.se_routes: List[SERoute] = []
         self.customer_to_se_route_map: Dict[int, SERoute] = {}
         self.unserved_customers: List["Customer"] = []
+        # Tổng quãng đường / thời gian di chuyển của mọi tuyến thuộc lời giải (đơn vị 2^-32, xem _TrackedRouteTotals).
+        self._dist_units: int = 0
+        self._time_units: int = 0
+        # Ảnh chụp gần nhất của lời giải (hoặc ảnh chụp đã dựng ra nó), để ảnh chụp sau dùng lại memento các tuyến không đổi.
+        self._snapshot: Optional[SolutionSnapshot] = None
+        # ChangeContext đang mở (nhật ký hoàn tác); các thay đổi cấu trúc dưới đây ghi thao tác ngược vào đó.
+        self._journal: Optional[ChangeContext] = None
+
+    @property
+    def change_context(self) -> Optional[ChangeContext]: return self._journal
 
-    def add_fe_route(self, fe_route: FERoute): self.fe_routes.append(fe_route)
-    def add_se_route(self, se_route: SERoute): self.se_routes.append(se_route); self.update_customer_map()
+    def add_fe_route(self, fe_route: FERoute):
+        if self._journal is not None: self._journal.record(OP_ADD_ROUTE, fe_route)
+        self.fe_routes.append(fe_route); self._attach_route(fe_route)
+    def add_se_route(self, se_route: SERoute):
+        if self._journal is not None: self._journal.record(OP_ADD_ROUTE, se_route)
+        self.se_routes.append(se_route); self._attach_route(se_route); self.map_route_customers(se_route)
     def remove_fe_route(self, fe_route: FERoute):
-        if fe_route in self.fe_routes: self.fe_routes.remove(fe_route)
+        if fe_route in self.fe_routes:
+            if self._journal is not None: self._journal.record(OP_REMOVE_ROUTE, fe_route)
+            self.fe_routes.remove(fe_route); self._detach_route(fe_route)
     def remove_se_route(self, se_route: SERoute):
-        if se_route in self.se_routes: self.se_routes.remove(se_route)
-        self.update_customer_map()
-    def link_routes(self, fe_route: FERoute, se_route: SERoute): fe_route.add_serviced_se_route(se_route); se_route.serving_fe_routes.add(fe_route)
-    def unlink_routes(self, fe_route: FERoute, se_route: SERoute): fe_route.remove_serviced_se_route(se_route); se_route.serving_fe_routes.discard(fe_route)
+        if se_route in self.se_routes:
+            if self._journal is not None: self._journal.record(OP_REMOVE_ROUTE, se_route)
+            self.se_routes.remove(se_route); self._detach_route(se_route)
+        self.unmap_route_customers(se_route)
+    def link_routes(self, fe_route: FERoute, se_route: SERoute):
+        if self._journal is not None: self._journal.record(OP_LINK, fe_route, se_route)
+        fe_route.add_serviced_se_route(se_route); se_route.serving_fe_routes.add(fe_route)
+    def unlink_routes(self, fe_route: FERoute, se_route: SERoute):
+        if self._journal is not None: self._journal.record(OP_UNLINK, fe_route, se_route)
+        fe_route.remove_serviced_se_route(se_route); se_route.serving_fe_routes.discard(fe_route)
+
+    # <<< MAP KHÁCH HÀNG -> TUYẾN SE ĐƯỢC CẬP NHẬT TĂNG DẦN >>>
+    # Mọi thay đổi khách hàng của các tuyến SE thuộc lời giải đi qua insert_customer / remove_customers /
+    # add_se_route / remove_se_route (và ChangeContext.rollback), mỗi lần chỉ sửa các mục liên quan.
+    # update_customer_map() dựng lại toàn bộ map, chỉ dùng khi ghép lời giải; check_customer_map() để gỡ lỗi.
+    def insert_customer(self, se_route: SERoute, customer: "Customer", pos: int):
+        if self._journal is not None: self._journal.record(OP_INSERT_CUSTOMER, se_route, pos)
+        se_route.insert_customer_at_pos(customer, pos)
+        self.customer_to_se_route_map[customer.id] = se_route
+        if config.DEBUG_CHECK_CUSTOMER_MAP: self.check_customer_map()
+
+    def remove_customers(self, se_route: SERoute, customer_ids: Set[int]) -> List[int]:
+        if self._journal is not None:
+            nodes_id = se_route.nodes_id
+            removed = [(pos, nodes_id[pos]) for pos in range(1, len(nodes_id) - 1) if nodes_id[pos] in customer_ids]
+            if removed: self._journal.record(OP_REMOVE_CUSTOMERS, se_route, removed)
+        removed_ids = se_route.remove_customers(customer_ids)
+        customer_map = self.customer_to_se_route_map
+        for cid in removed_ids: customer_map.pop(cid, None)
+        if config.DEBUG_CHECK_CUSTOMER_MAP: self.check_customer_map()
+        return removed_ids
+
+    def map_route_customers(self, se_route: SERoute):
+        customer_map = self.customer_to_se_route_map
+        for cid in se_route.nodes_id[1:-1]: customer_map[cid] = se_route
+
+    def unmap_route_customers(self, se_route: SERoute):
+        """Bỏ các khách hàng của se_route khỏi map (chỉ những mục đang trỏ tới chính tuyến này)."""
+        customer_map = self.customer_to_se_route_map
+        for cid in se_route.nodes_id[1:-1]:
+            if customer_map.get(cid) is se_route: del customer_map[cid]
+
     def update_customer_map(self): self.customer_to_se_route_map = {c.id: r for r in self.se_routes for c in r.get_customers()}
+
+    def check_customer_map(self):
+        """Kiểm tra map tăng dần khớp với map dựng lại từ đầu; ném RuntimeError nếu lệch (dùng khi gỡ lỗi)."""
+        expected = {cid: r for r in self.se_routes for cid in r.nodes_id[1:-1]}
+        actual = self.customer_to_se_route_map
+        if actual.keys() != expected.keys() or any(actual[cid] is not r for cid, r in expected.items()):
+            missing = sorted(expected.keys() - actual.keys()); extra = sorted(actual.keys() - expected.keys())
+            wrong = sorted(cid for cid, r in expected.items() if cid in actual and actual[cid] is not r)
+            raise RuntimeError(f"customer_to_se_route_map lech: thieu {missing}, thua {extra}, sai tuyen {wrong}")
     
+    # <<< HÀM MỤC TIÊU CẬP NHẬT THEO DELTA >>>
+    # Thành phần di chuyển được cộng dồn khi tổng của từng tuyến thay đổi (_TrackedRouteTotals), thành phần xe
+    # là số tuyến; mọi hàm chi phí dưới đây là O(1). recompute_objective_cost() tính lại từ đầu để kiểm tra.
+    def _attach_route(self, route: Union[FERoute, SERoute]):
+        route._owner = self
+        self._dist_units += round(route.total_dist * _OBJECTIVE_SCALE)
+        self._time_units += round(route.total_travel_time * _OBJECTIVE_SCALE)
+
+    def _detach_route(self, route: Union[FERoute, SERoute]):
+        if route._owner is self: route._owner = None
+        self._dist_units -= round(route.total_dist * _OBJECTIVE_SCALE)
+        self._time_units -= round(route.total_travel_time * _OBJECTIVE_SCALE)
+
+    def get_vehicle_cost(self) -> float:
+        """Chi phí phạt theo số xe FE / SE (0 nếu không tối ưu số xe)."""
+        if not config.OPTIMIZE_VEHICLE_COUNT: return 0.0
+        return len(self.fe_routes) * config.WEIGHT_FE_VEHICLE + len(self.se_routes) * config.WEIGHT_SE_VEHICLE
+
     def get_objective_cost(self) -> float:
-        primary_cost = 0.0
-        if config.PRIMARY_OBJECTIVE == "DISTANCE":
-            primary_cost = sum(r.total_dist for r in self.fe_routes) + sum(r.total_dist for r in self.se_routes)
-        elif config.PRIMARY_OBJECTIVE == "TRAVEL_TIME":
-            primary_cost = sum(r.total_travel_time for r in self.fe_routes) + sum(r.total_travel_time for r in self.se_routes)
-        else:
+        if config.PRIMARY_OBJECTIVE not in ("DISTANCE", "TRAVEL_TIME"):
             raise ValueError(f"Unknown PRIMARY_OBJECTIVE in config: {config.PRIMARY_OBJECTIVE}")
-        total_cost = config.WEIGHT_PRIMARY * primary_cost
-        if config.OPTIMIZE_VEHICLE_COUNT:
-            num_fe_vehicles = len(self.fe_routes)
-            num_se_vehicles = len(self.se_routes)
-            vehicle_cost = (num_fe_vehicles * config.WEIGHT_FE_VEHICLE) + (num_se_vehicles * config.WEIGHT_SE_VEHICLE)
-            total_cost += vehicle_cost
-        return total_cost
+        return config.WEIGHT_PRIMARY * self.get_primary_objective_cost() + self.get_vehicle_cost()
     
     # <<< HÀM MỚI ĐỂ HỖ TRỢ TÍNH NHIỆT ĐỘ >>>
     def get_primary_objective_cost(self) -> float:
@@ -209,27 +825,113 @@ class Solution:
         Chỉ tính toán và trả về thành phần chi phí chính (di chuyển),
         bỏ qua chi phí phạt của xe.
         """
-        if config.PRIMARY_OBJECTIVE == "DISTANCE":
-            return sum(r.total_dist for r in self.fe_routes) + sum(r.total_dist for r in self.se_routes)
-        elif config.PRIMARY_OBJECTIVE == "TRAVEL_TIME":
-            return sum(r.total_travel_time for r in self.fe_routes) + sum(r.total_travel_time for r in self.se_routes)
-        # Fallback an toàn
-        return sum(r.total_dist for r in self.fe_routes) + sum(r.total_dist for r in self.se_routes)
+        if config.PRIMARY_OBJECTIVE == "TRAVEL_TIME": return self._time_units / _OBJECTIVE_SCALE
+        # DISTANCE (và fallback an toàn)
+        return self._dist_units / _OBJECTIVE_SCALE
 
 
     def calculate_total_cost(self) -> float:
-        return sum(r.total_dist for r in self.fe_routes) + sum(r.total_dist for r in self.se_routes)
+        return self._dist_units / _OBJECTIVE_SCALE
+
+    def recompute_objective_cost(self) -> float:
+        """Hàm mục tiêu tính lại từ đầu trên mọi tuyến (chỉ dùng để kiểm tra giá trị cộng dồn)."""
+        routes = self.fe_routes + self.se_routes
+        attr = 'total_travel_time' if config.PRIMARY_OBJECTIVE == "TRAVEL_TIME" else 'total_dist'
+        return config.WEIGHT_PRIMARY * sum(getattr(r, attr) for r in routes) + self.get_vehicle_cost()
+
+    def check_objective(self, tolerance: float = 1e-6):
+        """Kiểm tra hàm mục tiêu cộng dồn khớp với tính lại từ đầu; ném RuntimeError nếu lệch (dùng khi gỡ lỗi)."""
+        tracked, expected = self.get_objective_cost(), self.recompute_objective_cost()
+        if abs(tracked - expected) > tolerance * max(1.0, abs(expected)):
+            raise RuntimeError(f"Ham muc tieu cong don lech: {tracked:.6f} != {expected:.6f}")
+
+    def snapshot(self) -> SolutionSnapshot:
+        self._snapshot = SolutionSnapshot(self, self._snapshot)
+        return self._snapshot
+
+
+class SolutionSnapshot:
+    """
+    Ảnh chụp bất biến của một lời giải, thay cho deepcopy khi lưu lời giải tốt nhất / khởi động lại.
+    Dữ liệu bài toán được dùng chung, mỗi tuyến chỉ lưu một RouteMemento đã bỏ tham chiếu tới các tuyến khác
+    (liên kết FE - SE lưu riêng theo chỉ số tuyến SE). Memento được dùng lại theo version giữa các ảnh chụp
+    liên tiếp, nên chụp lại một lời giải chỉ sao lưu các tuyến đã thay đổi từ lần chụp trước (copy-on-write).
+    """
+    __slots__ = ('problem', 'se_satellites', 'se_mementos', 'fe_mementos', 'fe_links', 'unserved_customers', 'cost')
+
+    def __init__(self, solution: Solution, previous: Optional[SolutionSnapshot] = None):
+        reusable = {m.version: m for m in previous.se_mementos + previous.fe_mementos} if previous is not None else {}
+        se_index = {route: i for i, route in enumerate(solution.se_routes)}
+        self.problem = solution.problem
+        self.se_satellites = tuple(route.satellite for route in solution.se_routes)
+        self.se_mementos = tuple(self._freeze(route, reusable) for route in solution.se_routes)
+        self.fe_mementos = tuple(self._freeze(route, reusable) for route in solution.fe_routes)
+        # Với mỗi tuyến FE: ((sat_id, chỉ số các tuyến SE tại vệ tinh đó), ...) theo đúng thứ tự của se_routes_by_sat.
+        self.fe_links = tuple(tuple((sat_id, tuple(se_index[r] for r in routes)) for sat_id, routes in route.se_routes_by_sat.items())
+                              for route in solution.fe_routes)
+        self.unserved_customers = tuple(solution.unserved_customers)
+        self.cost = solution.get_objective_cost()
+
+    @staticmethod
+    def _freeze(route: Union[FERoute, SERoute], reusable: Dict[int, RouteMemento]) -> RouteMemento:
+        """
+        Memento của tuyến, dùng lại memento cùng version nếu có. Memento có lịch trình "dirty" không được dùng lại
+        vì tổng của tuyến FE chỉ được cập nhật khi lập lịch lại (version không đổi).
+        """
+        memento = reusable.get(route.version)
+        if memento is not None and not memento.schedule_dirty: return memento
+        memento = route.backup()
+        if isinstance(route, SERoute): memento.serving_fe_routes = None
+        else: memento.serviced_se_routes = memento.se_routes_by_sat = None; memento.sat_schedule_cache = {}
+        return memento
+
+    def materialize(self) -> Solution:
+        """Dựng một lời giải mới (các tuyến mới, có thể sửa) từ ảnh chụp; ảnh chụp không bị thay đổi."""
+        problem = self.problem
+        solution = Solution(problem)
+        se_routes = []
+        for satellite, memento in zip(self.se_satellites, self.se_mementos):
+            route = SERoute(satellite, problem); route.restore(memento)
+            # Memento được dùng chung giữa các lần dựng: tuyến nhận bản sao riêng của các bộ đệm bị sửa tại chỗ.
+            route.nodes_id = memento.nodes_id.copy()
+            (route._service_start_times, route._waiting_times, route._forward_time_slacks,
+             route._suffix_waiting_times, route._latest_start_times) = (a[:] for a in route._schedule_arrays())
+            route.serving_fe_routes = set()
+            se_routes.append(route)
+        for memento, links in zip(self.fe_mementos, self.fe_links):
+            route = FERoute(problem); route.restore(memento)
+            route.se_routes_by_sat = {sat_id: tuple(se_routes[i] for i in indices) for sat_id, indices in links}
+            route.serviced_se_routes = {r for routes in route.se_routes_by_sat.values() for r in routes}
+            route._sat_schedule_cache = {}
+            for se_route in route.serviced_se_routes: se_route.serving_fe_routes.add(route)
+            solution.add_fe_route(route)
+        for route in se_routes: solution.add_se_route(route)
+        solution.unserved_customers = list(self.unserved_customers)
+        solution._snapshot = self
+        return solution
 
 
 class VRP2E_State:
-    def __init__(self, solution: Solution): 
-        self.solution = solution
+    """
+    Trạng thái ALNS. copy() chỉ chụp ảnh lời giải (SolutionSnapshot); lời giải có thể sửa chỉ được dựng lại
+    khi đọc .solution lần đầu, nên lưu lời giải tốt nhất không phải dựng lại nó. cost đọc từ ảnh chụp khi chưa dựng.
+    """
+    def __init__(self, solution: Optional[Solution] = None, snapshot: Optional[SolutionSnapshot] = None): 
+        self._solution = solution
+        self._snapshot = snapshot
+
+    @property
+    def solution(self) -> Solution:
+        if self._solution is None: self._solution = self._snapshot.materialize()
+        return self._solution
     
-    def copy(self): 
-        return copy.deepcopy(self)
+    def copy(self) -> "VRP2E_State": 
+        if self._solution is None: return VRP2E_State(snapshot=self._snapshot)
+        return VRP2E_State(snapshot=self._solution.snapshot())
     
     @property
     def cost(self) -> float: 
-        return self.solution.get_objective_cost()
+        if self._solution is None: return self._snapshot.cost
+        return self._solution.get_objective_cost()
         
 # --- END OF FILE data_structures.py ---
\ No newline at end of file
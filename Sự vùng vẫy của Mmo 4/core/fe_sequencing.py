@@ -0,0 +1,94 @@
+# --- START OF FILE core/fe_sequencing.py ---
+
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import config
+
+if TYPE_CHECKING:
+    from .problem_parser import ProblemInstance
+
+# Mô tả một vệ tinh trên tuyến FE: (sat_id, tải giao, tải nhận, thời điểm tới muộn nhất, thời lượng khi không chờ,
+# thời điểm xong sớm nhất). Xe FE tới lúc t không muộn hơn thời điểm tới muộn nhất thì mọi tuyến SE tại vệ tinh
+# đúng cửa sổ thời gian, và xe rời vệ tinh lúc max(t + thời lượng, thời điểm xong sớm nhất) (xem SERoute.departure_profile).
+SatelliteProfile = Tuple[int, float, float, float, float, float]
+# Nhãn của một trạng thái quy hoạch động: (thời gian di chuyển, thời điểm rời vệ tinh cuối, thứ tự đã ghé).
+_Label = Tuple[float, float, Tuple[int, ...]]
+
+def _add_label(labels: List[_Label], cost: float, time: float, order: Tuple[int, ...]):
+    """Thêm nhãn nếu không bị nhãn nào trội hơn (chi phí và thời điểm đều không lớn hơn), bỏ các nhãn nó trội hơn."""
+    for other_cost, other_time, _ in labels:
+        if other_cost <= cost and other_time <= time: return
+    labels[:] = [label for label in labels if not (cost <= label[0] and time <= label[1])]
+    labels.append((cost, time, order))
+
+class SatelliteSequencer:
+    """
+    Chọn thứ tự ghé vệ tinh của tuyến FE bằng quy hoạch động trên tập con (bitmask DP). Mỗi trạng thái
+    (tập vệ tinh đã ghé, vệ tinh cuối) giữ các nhãn Pareto (thời gian di chuyển, thời điểm rời), nên thứ tự
+    trả về là tối ưu chính xác theo thời gian di chuyển FE (tỷ lệ với quãng đường) trong các thứ tự thỏa mãn
+    thời điểm tới mỗi vệ tinh, tải trọng sau mỗi vệ tinh và deadline khi về depot.
+
+    Kết quả được ghi nhớ trong một cache LRU có giới hạn.
+    """
+    def __init__(self, problem: "ProblemInstance", max_satellites: Optional[int] = None, cache_size: Optional[int] = None):
+        self.problem = problem
+        self.max_satellites = config.FE_SEQUENCING_MAX_SATELLITES if max_satellites is None else max_satellites
+        self.cache_size = config.FE_SEQUENCING_CACHE_SIZE if cache_size is None else cache_size
+        self._cache: "OrderedDict[tuple, Optional[Tuple[int, ...]]]" = OrderedDict()
+
+    def best_order(self, profiles: Tuple[SatelliteProfile, ...], route_deadline: float) -> Optional[Tuple[int, ...]]:
+        """
+        Thứ tự sat_id tối ưu cho các vệ tinh trong profiles (sắp theo sat_id để khóa cache là duy nhất), hoặc None
+        nếu số vệ tinh vượt max_satellites hay không có thứ tự khả thi; khi đó tuyến FE dùng thứ tự theo khoảng
+        cách tới depot. Khóa cache là (profiles, route_deadline): tập vệ tinh kèm tải và profile thời gian.
+        """
+        if len(profiles) > self.max_satellites: return None
+        key = (profiles, route_deadline)
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        order = self._solve(profiles, route_deadline)
+        cache[key] = order
+        if len(cache) > self.cache_size: cache.popitem(last=False)
+        return order
+
+    def _solve(self, profiles: Tuple[SatelliteProfile, ...], route_deadline: float) -> Optional[Tuple[int, ...]]:
+        problem = self.problem
+        time_rows, depot_id = problem.time_rows, problem.depot.id
+        capacity = problem.fe_vehicle_capacity + 1e-6
+        n = len(profiles); full = (1 << n) - 1
+        sat_ids = [p[0] for p in profiles]
+        # Tải trên xe sau khi ghé một tập vệ tinh chỉ phụ thuộc vào tập đó, không phụ thuộc thứ tự ghé.
+        load_after = [0.0] * (full + 1)
+        load_after[0] = sum(p[1] for p in profiles)
+        for mask in range(1, full + 1):
+            low = (mask & -mask).bit_length() - 1
+            load_after[mask] = load_after[mask & (mask - 1)] - profiles[low][1] + profiles[low][2]
+        # labels[mask][vệ tinh cuối] (-1 = depot); duyệt mask tăng dần nên mọi trạng thái trước đã đầy đủ.
+        labels: List[Dict[int, List[_Label]]] = [{} for _ in range(full + 1)]
+        labels[0][-1] = [(0.0, 0.0, ())]
+        for mask in range(full):
+            for last, last_labels in labels[mask].items():
+                row = time_rows[depot_id if last < 0 else sat_ids[last]]
+                for k in range(n):
+                    next_mask = mask | (1 << k)
+                    if next_mask == mask or load_after[next_mask] > capacity: continue
+                    _, _, _, latest_arrival, duration, earliest_end = profiles[k]
+                    travel = row[sat_ids[k]]
+                    bucket = labels[next_mask].setdefault(k, [])
+                    for cost, time, order in last_labels:
+                        arrival = time + travel
+                        if arrival > latest_arrival + 1e-6: continue
+                        _add_label(bucket, cost + travel, max(arrival + duration, earliest_end), order + (sat_ids[k],))
+        best = None
+        for last, last_labels in labels[full].items():
+            back = time_rows[sat_ids[last]][depot_id]
+            for cost, time, order in last_labels:
+                if time + back > route_deadline + 1e-6: continue
+                if best is None or (cost + back, time + back) < best[:2]: best = (cost + back, time + back, order)
+        return best[2] if best is not None else None
+
+# --- END OF FILE core/fe_sequencing.py ---
@@ -0,0 +1,75 @@
+# --- START OF FILE core/instance_cache.py ---
+
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+import config
+
+# Tăng số này mỗi khi thay đổi nội dung/định dạng các mảng được lưu trong cache.
+CACHE_FORMAT_VERSION = 1
+
+# Các mảng được lưu: thuộc tính node (xem problem_parser.NODE_COLUMNS), tải trọng xe,
+# ma trận khoảng cách / thời gian và các mảng chỉ số láng giềng.
+CACHED_ARRAYS = ('type', 'x', 'y', 'demand', 'service_time', 'early', 'latest', 'deadline', 'capacities',
+                 'dist_matrix', 'time_matrix', 'customer_neighbor_ids', 'satellite_neighbor_ids')
+
+def instance_cache_key(file_path: str, vehicle_speed: float, dtype) -> str:
+    """
+    Khóa cache = hash nội dung file CSV + tốc độ xe + các tham số pruning + kiểu dữ liệu ma trận.
+    Đổi bất kỳ thành phần nào cũng sinh ra một mục cache mới.
+    """
+    hasher = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    params = (CACHE_FORMAT_VERSION, float(vehicle_speed), config.PRUNING_K_CUSTOMER_NEIGHBORS,
+              config.PRUNING_M_SATELLITE_NEIGHBORS, np.dtype(dtype).str)
+    hasher.update(repr(params).encode('utf-8'))
+    return hasher.hexdigest()
+
+def _cache_dir_for(file_path: str, vehicle_speed: float, dtype) -> str:
+    instance_name = os.path.splitext(os.path.basename(file_path))[0]
+    key = instance_cache_key(file_path, vehicle_speed, dtype)
+    return os.path.join(config.INSTANCE_CACHE_DIR, f"{instance_name}_{key[:16]}")
+
+def load_cached_instance(file_path: str, vehicle_speed: float, dtype) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Trả về dict các mảng đã lưu (mở bằng mmap, chỉ đọc), hoặc None nếu chưa có cache hợp lệ.
+    """
+    cache_dir = _cache_dir_for(file_path, vehicle_speed, dtype)
+    if not os.path.isdir(cache_dir):
+        return None
+    try:
+        return {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in CACHED_ARRAYS}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Bo qua cache hong tai '{cache_dir}': {e}")
+        return None
+
+def save_cached_instance(file_path: str, vehicle_speed: float, dtype, arrays: Dict[str, np.ndarray]):
+    """
+    Ghi các mảng ra một thư mục .npy (mỗi mảng một file, có thể mmap). Ghi vào thư mục tạm rồi
+    đổi tên để các tiến trình chạy song song không bao giờ đọc phải cache ghi dở.
+    Lỗi khi ghi cache chỉ được cảnh báo, không làm dừng chương trình.
+    """
+    cache_dir = _cache_dir_for(file_path, vehicle_speed, dtype)
+    if os.path.isdir(cache_dir):
+        return
+    tmp_dir = None
+    try:
+        os.makedirs(config.INSTANCE_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=config.INSTANCE_CACHE_DIR, prefix=".tmp_")
+        for name in CACHED_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arrays[name]))
+        os.rename(tmp_dir, cache_dir)
+        tmp_dir = None
+    except OSError as e:
+        print(f"Warning: Khong the ghi cache cho '{file_path}': {e}")
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# --- END OF FILE core/instance_cache.py ---
@@ -1,137 +1,326 @@
 # --- START OF FILE problem_parser.py ---
 
+from collections.abc import Mapping
+
 import pandas as pd
-import math
+import numpy as np
 import config
+from .instance_cache import load_cached_instance, save_cached_instance
+from .fe_sequencing import SatelliteSequencer
+
+# Mã loại node dạng số nguyên (trùng với cột 'Type' trong file dữ liệu)
+KIND_DEPOT = 0
+KIND_SATELLITE = 1
+KIND_DELIVERY = 2
+KIND_PICKUP = 3
+
+class NodeTable:
+    """
+    Bảng node dạng cột (struct-of-arrays): mỗi thuộc tính là một mảng numpy đánh chỉ số theo node id.
+    Thuộc tính không áp dụng cho một loại node được điền giá trị trung tính
+    (ready_time = 0, due_time = deadline = inf, demand = 0) để có thể đọc mà không cần kiểm tra loại.
+    """
+    __slots__ = ('kind', 'x', 'y', 'demand', 'service_time', 'ready_time', 'due_time', 'deadline')
+
+    def __init__(self, columns: dict):
+        kind = np.asarray(columns['type'], dtype=np.int64)
+        is_customer = (kind == KIND_DELIVERY) | (kind == KIND_PICKUP)
+        self.kind = np.where((kind >= KIND_DEPOT) & (kind <= KIND_PICKUP), kind, -1).astype(np.int8)
+        self.x = np.asarray(columns['x'], dtype=np.int64)
+        self.y = np.asarray(columns['y'], dtype=np.int64)
+        self.demand = np.where(is_customer, columns['demand'], 0.0)
+        self.service_time = np.where(is_customer | (kind == KIND_SATELLITE), columns['service_time'], 0.0)
+        self.ready_time = np.where(is_customer, columns['early'], 0.0)
+        self.due_time = np.where(is_customer, columns['latest'], np.inf)
+        self.deadline = np.where(kind == KIND_PICKUP, columns['deadline'], np.inf)
+
+    def __len__(self): return len(self.kind)
 
+# <<< CÁC LỚP NODE LÀ "VIEW" MỎNG (__slots__) TRỎ VÀO NodeTable >>>
 class Node:
-    def __init__(self, node_id, x, y):
+    __slots__ = ('id', '_table')
+    type = 'Node'
+
+    def __init__(self, node_id, table: NodeTable):
         self.id = int(node_id)
-        self.x = int(x)
-        self.y = int(y)
-        self.service_time = 0.0
+        self._table = table
+
+    @property
+    def kind(self) -> int: return int(self._table.kind[self.id])
+    @property
+    def x(self) -> int: return int(self._table.x[self.id])
+    @property
+    def y(self) -> int: return int(self._table.y[self.id])
+    @property
+    def service_time(self) -> float: return float(self._table.service_time[self.id])
 
 class Depot(Node):
-    def __init__(self, node_id, x, y):
-        super().__init__(node_id, x, y)
-        self.type = 'Depot'
+    __slots__ = ()
+    type = 'Depot'
 
 class Satellite(Node):
-    def __init__(self, node_id, x, y, st):
-        super().__init__(node_id, x, y)
-        self.type = 'Satellite'
-        self.service_time = float(st)
-        self.dist_id = self.id
+    __slots__ = ('coll_id',)
+    type = 'Satellite'
+
+    @property
+    def dist_id(self) -> int: return self.id
 
 class Customer(Node):
-    def __init__(self, node_id, x, y, d, st, et, lt):
-        super().__init__(node_id, x, y)
-        self.demand = float(d)
-        self.service_time = float(st)
-        self.ready_time = float(et)
-        self.due_time = float(lt)
+    __slots__ = ()
+
+    @property
+    def demand(self) -> float: return float(self._table.demand[self.id])
+    @property
+    def ready_time(self) -> float: return float(self._table.ready_time[self.id])
+    @property
+    def due_time(self) -> float: return float(self._table.due_time[self.id])
 
 class DeliveryCustomer(Customer):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.type = 'DeliveryCustomer'
+    __slots__ = ()
+    type = 'DeliveryCustomer'
 
 class PickupCustomer(Customer):
-    def __init__(self, node_id, x, y, d, st, et, lt, deadline):
-        super().__init__(node_id, x, y, d, st, et, lt)
-        self.type = 'PickupCustomer'
-        self.deadline = float(deadline)
+    __slots__ = ()
+    type = 'PickupCustomer'
+
+    @property
+    def deadline(self) -> float: return float(self._table.deadline[self.id])
+
+# Các cột thuộc tính node đọc từ file CSV (tên mảng -> tên cột trong file)
+NODE_COLUMNS = {'type': 'Type', 'x': 'X', 'y': 'Y', 'demand': 'Demand', 'service_time': 'Service Time',
+                'early': 'Early', 'latest': 'Latest', 'deadline': 'Deadline'}
+
+def _read_node_columns(file_path) -> dict:
+    """Đọc file CSV thành các mảng cột (chỉ số mảng = node id) và mảng tải trọng xe [FE, SE]."""
+    df = pd.read_csv(file_path)
+    df.columns = df.columns.str.strip()
+    columns = {}
+    for name, col in NODE_COLUMNS.items():
+        values = df[col].fillna(0) if col in df.columns else pd.Series(0, index=df.index)
+        columns[name] = values.to_numpy(dtype=np.float64)
+    columns['type'] = columns['type'].astype(np.int64)
+    columns['x'] = columns['x'].astype(np.int64)
+    columns['y'] = columns['y'].astype(np.int64)
+    columns['capacities'] = np.array([df.iloc[0]['FE Cap'], df.iloc[0]['SE Cap']], dtype=np.float64)
+    return columns
 
 class ProblemInstance:
     # <<< THÊM THAM SỐ verbose=True >>>
-    def __init__(self, file_path, vehicle_speed=1.0, verbose=True):
-        df = pd.read_csv(file_path)
-        df.columns = df.columns.str.strip()
+    def __init__(self, file_path, vehicle_speed=1.0, verbose=True, dtype=None, use_cache=None):
+        self.vehicle_speed = vehicle_speed
+        dtype = np.dtype(dtype or config.DISTANCE_MATRIX_DTYPE)
+        if use_cache is None: use_cache = config.ENABLE_INSTANCE_CACHE
+
+        # <<< ĐỌC TỪ CACHE NHỊ PHÂN (MMAP) NẾU CÓ, NGƯỢC LẠI PARSE CSV >>>
+        cached = load_cached_instance(file_path, vehicle_speed, dtype) if use_cache else None
+        columns = cached if cached is not None else _read_node_columns(file_path)
+
+        self._create_nodes(columns)
+        self.fe_vehicle_capacity = float(columns['capacities'][0])
+        self.se_vehicle_capacity = float(columns['capacities'][1])
+
+        if cached is not None:
+            self._set_distance_matrices(cached['dist_matrix'], cached['time_matrix'])
+        else:
+            # <<< MA TRẬN KHOẢNG CÁCH / THỜI GIAN DẠNG NUMPY, TÍNH VECTOR HÓA MỘT LẦN >>>
+            self._build_distance_matrices(self.node_table.x, self.node_table.y, dtype)
+        self._max_dist = float(self.dist_matrix.max()) if self.dist_matrix.size else 0.0
         
+        is_customer = np.isin(self.node_table.kind, (KIND_DELIVERY, KIND_PICKUP))
+        self._max_due_time = float(self.node_table.due_time[is_customer].max(initial=0.0))
+        self._max_demand = float(self.node_table.demand[is_customer].max(initial=0.0))
+        self._precompute_time_window_bounds()
+        self.fe_sequencer = SatelliteSequencer(self)
+
+        if cached is not None:
+            self._set_neighbor_lists(cached['customer_neighbor_ids'], cached['satellite_neighbor_ids'])
+        else:
+            print("\nPre-processing for pruning candidate lists...")
+            self._precompute_neighbors()
+            print("Pre-processing complete.")
+            if use_cache:
+                save_cached_instance(file_path, vehicle_speed, dtype, dict(
+                    columns, dist_matrix=self.dist_matrix, time_matrix=self.time_matrix,
+                    customer_neighbor_ids=self.customer_neighbor_ids, satellite_neighbor_ids=self.satellite_neighbor_ids))
+
+    def _create_nodes(self, columns: dict):
+        self.node_table = table = NodeTable(columns)
         self.depot = None
         self.satellites = []
         self.customers = []
         node_objects = {}
         
-        for i, row in df.iterrows():
-            node = None
-            if row['Type'] == 0:
-                node = Depot(i, row['X'], row['Y'])
-                self.depot = node
-            elif row['Type'] == 1:
-                node = Satellite(i, row['X'], row['Y'], row['Service Time'])
-                self.satellites.append(node)
-            elif row['Type'] == 2:
-                node = DeliveryCustomer(i, row['X'], row['Y'], row['Demand'], row['Service Time'], row['Early'], row['Latest'])
-                self.customers.append(node)
-            elif row['Type'] == 3:
-                node = PickupCustomer(i, row['X'], row['Y'], row['Demand'], row['Service Time'], row['Early'], row['Latest'], row['Deadline'])
-                self.customers.append(node)
-            
-            if node:
-                node_objects[i] = node
+        node_classes = {KIND_DEPOT: Depot, KIND_SATELLITE: Satellite, KIND_DELIVERY: DeliveryCustomer, KIND_PICKUP: PickupCustomer}
+        for i, kind in enumerate(table.kind.tolist()):
+            node_class = node_classes.get(kind)
+            if node_class is None: continue
+            node = node_class(i, table)
+            if kind == KIND_DEPOT: self.depot = node
+            elif kind == KIND_SATELLITE: self.satellites.append(node)
+            else: self.customers.append(node)
+            node_objects[i] = node
         
         self.node_objects = node_objects
         self.total_nodes = len(node_objects)
         
         for sat in self.satellites:
             sat.coll_id = sat.id + self.total_nodes
-        
-        self.fe_vehicle_capacity = df.iloc[0]['FE Cap']
-        self.se_vehicle_capacity = df.iloc[0]['SE Cap']
-        self.vehicle_speed = vehicle_speed
-        
-        nodes = [self.depot] + self.satellites + self.customers
-        self.dist_matrix = {n1.id: {n2.id: math.sqrt((n1.x - n2.x)**2 + (n1.y - n2.y)**2) for n2 in nodes} for n1 in nodes}
-        
-        self._max_dist = 0.0
-        for row in self.dist_matrix.values():
-            if not row: continue
-            max_row = max(row.values())
-            if max_row > self._max_dist:
-                self._max_dist = max_row
-        
-        self._max_due_time = 0.0
-        self._max_demand = 0.0
-        for cust in self.customers:
-            if cust.due_time > self._max_due_time:
-                self._max_due_time = cust.due_time
-            if cust.demand > self._max_demand:
-                self._max_demand = cust.demand
-
-        print("\nPre-processing for pruning candidate lists...")
-        self._precompute_neighbors()
-        print("Pre-processing complete.")
+        # <<< ÁNH XẠ ID TRONG TUYẾN -> CHỈ SỐ VẬT LÝ, TÍNH TRƯỚC MỘT LẦN >>>
+        # Thay cho phép "node_id % total_nodes" ở mỗi bước của các vòng lặp lập lịch / đánh giá chèn.
+        self.route_node_phys = list(range(len(table))) + [i % self.total_nodes for i in range(len(table), len(table) + self.total_nodes)]
+        self.customer_ids = np.array([c.id for c in self.customers], dtype=np.int64)
+
+        # Bản sao dạng list của các cột, cho truy cập vô hướng trong các vòng lặp nóng
+        # (thay cho getattr/hasattr trên đối tượng node).
+        self.node_kind = table.kind.tolist()
+        self.node_demand = table.demand.tolist()
+        self.node_service_time = table.service_time.tolist()
+        self.node_ready_time = table.ready_time.tolist()
+        self.node_due_time = table.due_time.tolist()
+        self.node_deadline = table.deadline.tolist()
+        # Thay đổi tải trọng của xe SE khi phục vụ node: giao hàng (-demand), lấy hàng (+demand), còn lại 0.
+        self.node_signed_demand = np.where(table.kind == KIND_DELIVERY, -table.demand, table.demand).tolist()
+        # Thời gian phục vụ dùng khi lập lịch tuyến SE: xe SE không tốn thời gian phục vụ tại vệ tinh.
+        self.node_effective_service_time = np.where(table.kind == KIND_SATELLITE, 0.0, table.service_time).tolist()
+
+    def _build_distance_matrices(self, xs: np.ndarray, ys: np.ndarray, dtype=None):
+        """
+        Xây dựng ma trận khoảng cách (dense, liên tục) và ma trận thời gian di chuyển
+        đánh chỉ số theo node id, trong một lần tính vector hóa.
+        """
+        dtype = np.dtype(dtype or config.DISTANCE_MATRIX_DTYPE)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        dx = xs[:, None] - xs[None, :]
+        dy = ys[:, None] - ys[None, :]
+        dist_matrix = np.ascontiguousarray(np.sqrt(dx * dx + dy * dy), dtype=dtype)
+        if self.vehicle_speed > 0:
+            time_matrix = np.ascontiguousarray(dist_matrix / dtype.type(self.vehicle_speed), dtype=dtype)
+        else:
+            time_matrix = np.full(dist_matrix.shape, np.inf, dtype=dtype)
+        self._set_distance_matrices(dist_matrix, time_matrix)
+
+    def _set_distance_matrices(self, dist_matrix: np.ndarray, time_matrix: np.ndarray):
+        self.dist_matrix = dist_matrix
+        self.time_matrix = time_matrix
+        # Bản sao dạng list lồng nhau: truy cập vô hướng [i][j] trong các vòng lặp nóng
+        # nhanh hơn nhiều so với đánh chỉ số từng phần tử của mảng numpy.
+        self.dist_rows = self.dist_matrix.tolist()
+        self.time_rows = self.time_matrix.tolist()
+
+    def _precompute_time_window_bounds(self):
+        """
+        Tiền xử lý các điều kiện cần về cửa sổ thời gian (không phụ thuộc lời giải), dùng để loại
+        sớm các vị trí chèn / vệ tinh chắc chắn không khả thi trước khi mô phỏng lịch trình:
+        - tw_compatible[i, j]: j có thể được phục vụ ngay sau i, tức ready_i + service_i + t_ij <= due_j.
+        - earliest_start_via_sat[s, c]: thời điểm sớm nhất bắt đầu phục vụ c từ vệ tinh thứ s
+          (xe FE rời depot lúc 0 và đi thẳng tới vệ tinh, xe SE xuất phát ngay).
+        - sat_can_serve[s, c]: c có thể nằm trong một tuyến SE của vệ tinh thứ s (kể cả deadline lấy hàng,
+          vì xe FE cần ít nhất t(s, depot) để về depot).
+        Các mặt nạ bit (Python int) tương ứng cho kiểm tra vô hướng trong vòng lặp nóng:
+        tw_succ_mask[i] có bit j khi j đi sau i được, tw_pred_mask[j] có bit i khi i đi trước j được,
+        sat_serve_mask[sat.id] có bit c khi vệ tinh phục vụ được c.
+        """
+        table = self.node_table
+        time_matrix = np.asarray(self.time_matrix, dtype=np.float64)
+        service_time = np.asarray(self.node_effective_service_time, dtype=np.float64)
+        self.tw_compatible = (table.ready_time + service_time)[:, None] + time_matrix <= table.due_time[None, :] + 1e-6
+
+        sat_ids = np.array([s.id for s in self.satellites], dtype=np.int64)
+        depot_id = self.depot.id if self.depot is not None else 0
+        sat_to_node = time_matrix[sat_ids, :]
+        node_to_depot_via_sat = time_matrix[:, sat_ids].T + time_matrix[sat_ids, depot_id][:, None]
+        self.earliest_start_via_sat = np.maximum(table.ready_time[None, :], time_matrix[depot_id, sat_ids][:, None] + sat_to_node)
+        earliest_return = self.earliest_start_via_sat + service_time[None, :] + node_to_depot_via_sat
+        self.sat_can_serve = (self.earliest_start_via_sat <= table.due_time[None, :] + 1e-6) & (earliest_return <= table.deadline[None, :] + 1e-6)
+
+        self.tw_succ_mask = _row_bitsets(self.tw_compatible)
+        self.tw_pred_mask = _row_bitsets(self.tw_compatible.T)
+        self.sat_serve_mask = dict(zip(sat_ids.tolist(), _row_bitsets(self.sat_can_serve)))
 
     def get_distance(self, n1, n2):
-        return self.dist_matrix.get(n1, {}).get(n2, float('inf'))
+        try: return self.dist_rows[n1][n2]
+        except IndexError: return float('inf')
     
     def get_travel_time(self, n1, n2):
-        return self.get_distance(n1, n2) / self.vehicle_speed if self.vehicle_speed > 0 else float('inf')
+        try: return self.time_rows[n1][n2]
+        except IndexError: return float('inf')
 
     def _precompute_neighbors(self):
-        self.customer_neighbors = {}
-        k = config.PRUNING_K_CUSTOMER_NEIGHBORS
-        if k > 0:
-            for cust1 in self.customers:
-                neighbors = []
-                for cust2 in self.customers:
-                    if cust1.id == cust2.id:
-                        continue
-                    dist = self.get_distance(cust1.id, cust2.id)
-                    neighbors.append((cust2, dist))
-                neighbors.sort(key=lambda x: x[1])
-                self.customer_neighbors[cust1.id] = [neighbor_cust for neighbor_cust, dist in neighbors[:k]]
+        """
+        Tính láng giềng gần nhất bằng np.argpartition trên các hàng của ma trận khoảng cách.
+        Kết quả chính là các mảng chỉ số nguyên (node id), một hàng cho mỗi khách hàng
+        theo thứ tự của self.customers; các danh sách đối tượng được suy ra khi cần.
+        """
+        satellite_ids = np.array([s.id for s in self.satellites], dtype=np.int64)
+        k = max(config.PRUNING_K_CUSTOMER_NEIGHBORS, 0)
+        m = max(config.PRUNING_M_SATELLITE_NEIGHBORS, 0)
+        customer_neighbor_ids = _k_nearest(self.dist_matrix, self.customer_ids, self.customer_ids, k, exclude_self=True)
+        satellite_neighbor_ids = _k_nearest(self.dist_matrix, self.customer_ids, satellite_ids, m)
+        self._set_neighbor_lists(customer_neighbor_ids, satellite_neighbor_ids)
 
+    def _set_neighbor_lists(self, customer_neighbor_ids: np.ndarray, satellite_neighbor_ids: np.ndarray):
+        self.customer_neighbor_ids = customer_neighbor_ids
+        self.satellite_neighbor_ids = satellite_neighbor_ids
+        self.customer_neighbors = {}
+        if config.PRUNING_K_CUSTOMER_NEIGHBORS > 0:
+            self.customer_neighbors = _NeighborLists(self.customer_ids, customer_neighbor_ids, self.node_objects)
         self.satellite_neighbors = {}
-        m = config.PRUNING_M_SATELLITE_NEIGHBORS
-        if m > 0:
-            for cust in self.customers:
-                neighbors = []
-                for sat in self.satellites:
-                    dist = self.get_distance(cust.id, sat.id)
-                    neighbors.append((sat, dist))
-                neighbors.sort(key=lambda x: x[1])
-                self.satellite_neighbors[cust.id] = [neighbor_sat for neighbor_sat, dist in neighbors[:m]]
+        if config.PRUNING_M_SATELLITE_NEIGHBORS > 0:
+            self.satellite_neighbors = _NeighborLists(self.customer_ids, satellite_neighbor_ids, self.node_objects)
+
+
+def _row_bitsets(matrix: np.ndarray) -> list:
+    """Đổi từng hàng của ma trận bool thành một số nguyên Python có bit j = matrix[i, j]."""
+    packed = np.packbits(matrix, axis=1, bitorder='little')
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+def _k_nearest(dist_matrix: np.ndarray, row_ids: np.ndarray, col_ids: np.ndarray, k: int,
+               exclude_self: bool = False, chunk_size: int = 1024) -> np.ndarray:
+    """
+    Trả về mảng (len(row_ids), k) chứa id của k cột gần nhất cho mỗi hàng, sắp tăng dần theo
+    khoảng cách (hòa thì giữ thứ tự trong col_ids). Xử lý theo từng khối hàng để giới hạn bộ nhớ
+    tạm, nên tổng chi phí là O(N·M) thay vì O(N·M·log M) của việc sắp xếp toàn bộ từng hàng.
+    """
+    k = min(k, len(col_ids) - (1 if exclude_self else 0))
+    result = np.empty((len(row_ids), max(k, 0)), dtype=np.int64)
+    if k <= 0 or len(row_ids) == 0:
+        return result
+    for start in range(0, len(row_ids), chunk_size):
+        rows = row_ids[start:start + chunk_size]
+        block = dist_matrix[np.ix_(rows, col_ids)].astype(np.float64)
+        if exclude_self:
+            block[rows[:, None] == col_ids[None, :]] = np.inf
+        if k < block.shape[1]:
+            cand = np.argpartition(block, k - 1, axis=1)[:, :k]
+        else:
+            cand = np.tile(np.arange(block.shape[1]), (len(rows), 1))
+        cand_dist = np.take_along_axis(block, cand, axis=1)
+        order = np.lexsort((cand, cand_dist), axis=1)
+        result[start:start + len(rows)] = col_ids[np.take_along_axis(cand, order, axis=1)]
+    return result
+
+
+class _NeighborLists(Mapping):
+    """
+    Ánh xạ customer id -> danh sách đối tượng láng giềng, được suy ra (và ghi nhớ)
+    từ mảng chỉ số khi được truy cập lần đầu.
+    """
+    def __init__(self, row_ids: np.ndarray, neighbor_ids: np.ndarray, node_objects: dict):
+        self._row_of = {nid: row for row, nid in enumerate(row_ids.tolist())}
+        self._neighbor_ids = neighbor_ids
+        self._node_objects = node_objects
+        self._lists = {}
+
+    def __getitem__(self, cust_id):
+        neighbors = self._lists.get(cust_id)
+        if neighbors is None:
+            row = self._row_of[cust_id]
+            neighbors = [self._node_objects[nid] for nid in self._neighbor_ids[row].tolist()]
+            self._lists[cust_id] = neighbors
+        return neighbors
+
+    def __iter__(self): return iter(self._row_of)
+    def __len__(self): return len(self._row_of)
 
 # --- END OF FILE problem_parser.py ---
\ No newline at end of file
@@ -1,28 +1,59 @@
 # --- START OF FILE core/transaction.py ---
 
 from __future__ import annotations
-from typing import TYPE_CHECKING, Dict, List, Union
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+
+import config
 
 # Khối này chỉ dùng cho type hinting, không gây lỗi runtime
 if TYPE_CHECKING:
     from .data_structures import SERoute, FERoute, Solution
 
 class RouteMemento:
-    # ... (Nội dung lớp RouteMemento không đổi)
+    """
+    Trạng thái sao lưu của một tuyến (backup / restore). Bất biến: các list / dict sau của tuyến không bao giờ bị sửa
+    tại chỗ, mỗi lần cập nhật tuyến gán một đối tượng mới, nên memento (và stamp của nhật ký hoàn tác, xem
+    FERoute.stamp) lưu chúng theo tham chiếu thay vì sao chép: profile tải của tuyến SE (load_profile,
+    prefix_max_load, suffix_max_load); lịch trình (các FEScheduleEvent), đường đi, cache theo vệ tinh, chỉ mục
+    tuyến SE theo vệ tinh và tải cache của tuyến FE.
+    """
+    __slots__ = ('nodes_id', 'total_dist', 'total_travel_time', 'total_load_pickup', 'total_load_delivery',
+                 'service_start_times', 'waiting_times', 'forward_time_slacks', 'suffix_waiting_times', 'latest_start_times',
+                 'departure_profile', 'load_profile', 'prefix_max_load', 'suffix_max_load', 'serving_fe_routes', 'load_profile_dirty',
+                 'serviced_se_routes', 'schedule', 'total_time', 'route_deadline', 'schedule_dirty', 'sat_schedule_cache',
+                 'se_routes_by_sat', 'fe_loads', 'path',
+                 'version')
+
     def __init__(self, route: Union["SERoute", "FERoute"]):
+        self.version = route.version
         if hasattr(route, 'nodes_id'):
             self.nodes_id = route.nodes_id.copy()
             self.total_dist = route.total_dist
             self.total_travel_time = route.total_travel_time
             self.total_load_pickup = route.total_load_pickup
             self.total_load_delivery = route.total_load_delivery
-            self.service_start_times = route.service_start_times.copy()
-            self.waiting_times = route.waiting_times.copy()
-            self.forward_time_slacks = route.forward_time_slacks.copy()
+            # Lịch trình SE là các array('d'): cắt lát = sao chép nguyên bộ đệm. Sao lưu nguyên trạng thái
+            # (kể cả cờ dirty) mà không ép tính lại lịch trình.
+            self.service_start_times = route._service_start_times[:]
+            self.waiting_times = route._waiting_times[:]
+            self.forward_time_slacks = route._forward_time_slacks[:]
+            self.suffix_waiting_times = route._suffix_waiting_times[:]
+            self.latest_start_times = route._latest_start_times[:]
+            self.departure_profile = (route._no_wait_duration, route._earliest_end, route._min_deadline)
+            self.schedule_dirty = route._schedule_dirty
+            self.load_profile = route._load_profile
+            self.prefix_max_load = route._prefix_max_load
+            self.suffix_max_load = route._suffix_max_load
+            self.load_profile_dirty = route._load_profile_dirty
             self.serving_fe_routes = route.serving_fe_routes.copy()
-        elif hasattr(route, 'schedule'):
+        elif hasattr(route, 'serviced_se_routes'):
             self.serviced_se_routes = route.serviced_se_routes.copy()
-            self.schedule = route.schedule.copy()
+            self.schedule = route._schedule
+            self.path = route._path
+            self.schedule_dirty = route._schedule_dirty
+            self.sat_schedule_cache = route._sat_schedule_cache
+            self.se_routes_by_sat = route.se_routes_by_sat
+            self.fe_loads = (route._sat_loads, route._total_load_delivery, route._total_load_pickup, route._loads_dirty)
             self.total_dist = route.total_dist
             self.total_time = route.total_time
             self.total_travel_time = route.total_travel_time
@@ -31,53 +62,116 @@ class RouteMemento:
             raise TypeError(f"Unsupported route type for Memento: {type(route)}")
 
 
+# Các thao tác được ghi trong nhật ký hoàn tác của ChangeContext: (mã thao tác, tuyến, tham số).
+OP_INSERT_CUSTOMER = 0   # (se_route, vị trí đã chèn)
+OP_REMOVE_CUSTOMERS = 1  # (se_route, [(vị trí cũ, customer_id), ...] theo vị trí tăng dần)
+OP_ADD_ROUTE = 2         # (tuyến, None)
+OP_REMOVE_ROUTE = 3      # (tuyến, None)
+OP_LINK = 4              # (fe_route, se_route)
+OP_UNLINK = 5            # (fe_route, se_route)
+
 class ChangeContext:
-    # ... (Nội dung các hàm __init__, backup_route, ... không đổi)
+    """
+    Nhật ký hoàn tác (undo journal) của một lượt destroy + repair. Trong khi context đang mở, mọi thay đổi cấu trúc
+    của lời giải đi qua Solution (chèn / xóa khách hàng, thêm / bỏ tuyến, nối / tách FE - SE) ghi thao tác ngược
+    tương ứng; lần đầu một tuyến bị chạm, chỉ các giá trị vô hướng của nó được ghi lại (route.stamp(): tổng,
+    tải, version, thời điểm xuất phát...), không sao chép nodes_id, lịch trình hay tập liên kết. Tuyến SE có thời
+    điểm xuất phát bị đổi khi lập lịch lại tuyến FE tự ghi stamp (SERoute.set_start_time).
+    rollback() phát lại nhật ký theo thứ tự ngược rồi khôi phục các stamp; lịch trình SE bị đánh dấu dirty
+    và được tính lại khi đọc lần đầu.
+
+    <<< SAVEPOINT LỒNG NHAU >>>
+    savepoint() mở một mức mới (độ dài nhật ký, số khách hàng chưa phục vụ, stamp các tuyến bị chạm từ lúc mở);
+    rollback_to_savepoint() chỉ hoàn tác phần nhật ký sau mức đó, release_savepoint() giữ lại các thay đổi cho
+    mức ngoài. Chi phí của một phép thử (savepoint -> thay đổi -> rollback_to_savepoint) tỷ lệ với số tuyến
+    thực sự bị chạm, không phụ thuộc kích thước tuyến FE hay lời giải.
+    """
     def __init__(self, solution: "Solution"):
         self.solution = solution
-        self.affected_routes_mementos: Dict[Union["SERoute", "FERoute"], RouteMemento] = {}
-        self.newly_created_routes: List[Union["SERoute", "FERoute"]] = []
-        self.removed_routes: List[Union["SERoute", "FERoute"]] = []
+        self.journal: List[tuple] = []
+        # Mức 0 là cả context. Stamp của một tuyến được ghi vào mọi mức đang mở chưa có nó (chưa bị chạm từ lúc
+        # mở các mức đó nên trạng thái hiện tại chính là trạng thái khi mở), nên stamp của mức trong luôn có ở mức ngoài.
+        self.savepoints: List[Tuple[int, int, Dict[Union["SERoute", "FERoute"], tuple]]] = [(0, len(solution.unserved_customers), {})]
+        solution._journal = self
+
+    def stamp_route(self, route: Union["SERoute", "FERoute"]):
+        """Ghi stamp của tuyến ở các mức savepoint chưa có nó."""
+        stamp = None
+        for _, _, stamps in reversed(self.savepoints):
+            if route in stamps: return
+            if stamp is None: stamp = route.stamp()
+            stamps[route] = stamp
 
     def backup_route(self, route: Union["SERoute", "FERoute"]):
-        if route not in self.affected_routes_mementos:
-            self.affected_routes_mementos[route] = route.backup()
+        """Ghi stamp của tuyến, kèm các tuyến FE phục vụ nó nếu là tuyến SE (thay đổi tuyến SE đánh dấu chúng cần lập lịch lại)."""
+        self.stamp_route(route)
+        for fe_route in getattr(route, 'serving_fe_routes', ()): self.stamp_route(fe_route)
+
+    def record(self, op: int, route: Union["SERoute", "FERoute"], arg=None):
+        """Ghi một thao tác (gọi TRƯỚC khi thực hiện nó, để stamp chứa trạng thái trước thay đổi)."""
+        self.backup_route(route)
+        if op in (OP_LINK, OP_UNLINK): self.backup_route(arg)
+        self.journal.append((op, route, arg))
 
-    def track_new_route(self, route: Union["SERoute", "FERoute"]):
-        self.newly_created_routes.append(route)
+    def savepoint(self) -> int:
+        """Mở một savepoint lồng trong các mức hiện có; trả về mức của nó."""
+        self.savepoints.append((len(self.journal), len(self.solution.unserved_customers), {}))
+        return len(self.savepoints) - 1
 
-    def track_removed_route(self, route: Union["SERoute", "FERoute"]):
-        self.removed_routes.append(route)
+    def release_savepoint(self, level: int):
+        """Đóng savepoint level (và các mức bên trong), giữ các thay đổi: chúng được hoàn tác cùng mức ngoài."""
+        del self.savepoints[max(level, 1):]
+
+    def rollback_to_savepoint(self, level: int):
+        """Hoàn tác các thay đổi kể từ lúc mở savepoint level rồi đóng nó (và các mức bên trong)."""
+        self._undo(*self.savepoints[level])
+        del self.savepoints[max(level, 1):]
 
     def rollback(self):
-        """Hoàn tác tất cả các thay đổi đã được theo dõi trong context này."""
+        """Hoàn tác tất cả các thay đổi đã được ghi trong context này và tách context khỏi lời giải."""
+        self._undo(*self.savepoints[0])
+        self.savepoints = [(0, len(self.solution.unserved_customers), {})]
+        self.close()
+        
+        # Kiểm tra map toàn cục và hàm mục tiêu cộng dồn của Solution (chế độ gỡ lỗi)
+        if config.DEBUG_CHECK_CUSTOMER_MAP: self.solution.check_customer_map()
+        if config.DEBUG_CHECK_OBJECTIVE: self.solution.check_objective()
+
+    def close(self):
+        """Tách context khỏi lời giải: các thay đổi sau đó không còn được ghi lại."""
+        if self.solution._journal is self: self.solution._journal = None
+
+    def _undo(self, journal_len: int, unserved_count: int, stamps: Dict[Union["SERoute", "FERoute"], tuple]):
         
         # <<< SỬA LỖI TẠI ĐÂY >>>
         # Sử dụng import tương đối để tìm module trong cùng package 'core'
-        from .data_structures import SERoute, FERoute
-        
-        # 1. Thêm lại các route đã bị xóa
-        for route in self.removed_routes:
-            if isinstance(route, SERoute):
-                if route not in self.solution.se_routes:
-                    self.solution.se_routes.append(route)
-            elif isinstance(route, FERoute):
-                if route not in self.solution.fe_routes:
-                    self.solution.fe_routes.append(route)
-
-        # 2. Xóa các route mới được tạo
-        for route in self.newly_created_routes:
-            if isinstance(route, SERoute):
-                if route in self.solution.se_routes:
-                    self.solution.se_routes.remove(route)
-            elif isinstance(route, FERoute):
-                if route in self.solution.fe_routes:
-                    self.solution.fe_routes.remove(route)
-
-        # 3. Khôi phục trạng thái của các route đã bị thay đổi
-        for route, memento in self.affected_routes_mementos.items():
-            route.restore(memento)
-        
-        # 4. Cập nhật lại các map toàn cục của Solution
-        self.solution.update_customer_map()
+        from .data_structures import SERoute
+
+        solution = self.solution
+        # Các thao tác hoàn tác đi qua chính các hàm của Solution: tạm tách context để chúng không được ghi lại.
+        attached, solution._journal = solution._journal, None
+        customer_map = solution.customer_to_se_route_map
+
+        # 1. Phát lại phần nhật ký sau journal_len theo thứ tự ngược (map khách hàng -> tuyến SE được sửa theo từng thao tác)
+        for op, route, arg in reversed(self.journal[journal_len:]):
+            if op == OP_INSERT_CUSTOMER:
+                cid = route.undo_insert(arg)
+                if customer_map.get(cid) is route: del customer_map[cid]
+            elif op == OP_REMOVE_CUSTOMERS:
+                route.undo_remove(arg)
+                for _, cid in arg: customer_map[cid] = route
+            elif op == OP_ADD_ROUTE:
+                if isinstance(route, SERoute): solution.remove_se_route(route)
+                else: solution.remove_fe_route(route)
+            elif op == OP_REMOVE_ROUTE:
+                if isinstance(route, SERoute): solution.add_se_route(route)
+                else: solution.add_fe_route(route)
+            elif op == OP_LINK: solution.unlink_routes(route, arg)
+            elif op == OP_UNLINK: solution.link_routes(route, arg)
+        del self.journal[journal_len:]
+
+        # 2. Khôi phục giá trị vô hướng của các tuyến đã bị chạm (hàm mục tiêu cộng dồn tự cập nhật theo tổng của tuyến)
+        for route, stamp in stamps.items(): route.restore_stamp(stamp)
+        del solution.unserved_customers[unserved_count:]
+        solution._journal = attached
 # --- END OF FILE core/transaction.py ---
\ No newline at end of file
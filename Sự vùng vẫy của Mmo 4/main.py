@@ -139,11 +139,11 @@ def merge_solutions(sub_solutions_states: list, master_problem: ProblemInstance)
             # <<< BƯỚC SỬA LỖI: GÁN LẠI PROBLEM CHO TỪNG ROUTE >>>
             for fe_route in sub_solution.fe_routes:
                 fe_route.problem = master_problem
-                master_solution.fe_routes.append(fe_route)
+                master_solution.add_fe_route(fe_route)
             
             for se_route in sub_solution.se_routes:
                 se_route.problem = master_problem
-                master_solution.se_routes.append(se_route)
+                master_solution.add_se_route(se_route)
             
             master_solution.unserved_customers.extend(sub_solution.unserved_customers)
 
@@ -210,7 +210,7 @@ def validate_solution_feasibility(solution: Solution):
     for se_route in solution.se_routes:
         if se_route.total_load_delivery > problem.se_vehicle_capacity + 1e-6: errors.append(f"SE Route (Sat {se_route.satellite.id}): Tai trong giao hang ban dau ({se_route.total_load_delivery:.2f}) vuot qua suc chua ({problem.se_vehicle_capacity:.2f})")
         for cust in se_route.get_customers():
-            start_time = se_route.service_start_times.get(cust.id)
+            start_time = se_route.get_service_start_time(cust.id)
             if start_time is None: errors.append(f"SE Route (Sat {se_route.satellite.id}): Khach hang {cust.id} co trong tuyen nhung khong co thoi gian bat dau."); continue
             if start_time > cust.due_time + 1e-6: errors.append(f"SE Route (Sat {se_route.satellite.id}): Khach hang {cust.id} phuc vu tre (Bat dau: {start_time:.2f} > Due: {cust.due_time:.2f})")
         if not se_route.serving_fe_routes: errors.append(f"SE Route (Sat {se_route.satellite.id}): Khong duoc phuc vu boi bat ky tuyen FE nao.")
@@ -218,8 +218,8 @@ def validate_solution_feasibility(solution: Solution):
         if not fe_route.schedule and fe_route.serviced_se_routes: errors.append(f"FE Route #{i+1}: Khong co lich trinh nhung van phuc vu {len(fe_route.serviced_se_routes)} tuyen SE."); continue
         if not fe_route.schedule: continue
         for event in fe_route.schedule:
-            if event['load_after'] < -1e-6 or event['load_after'] > problem.fe_vehicle_capacity + 1e-6: errors.append(f"FE Route #{i+1}: Vi pham suc chua. Tai trong: {event['load_after']:.2f}, Suc chua: {problem.fe_vehicle_capacity:.2f}")
-        arrival_at_depot = fe_route.schedule[-1]['arrival_time']
+            if event.load_after < -1e-6 or event.load_after > problem.fe_vehicle_capacity + 1e-6: errors.append(f"FE Route #{i+1}: Vi pham suc chua. Tai trong: {event.load_after:.2f}, Suc chua: {problem.fe_vehicle_capacity:.2f}")
+        arrival_at_depot = fe_route.schedule[-1].arrival_time
         all_deadlines = {cust.deadline for se in fe_route.serviced_se_routes for cust in se.get_customers() if isinstance(cust, PickupCustomer)}
         if all_deadlines and arrival_at_depot > min(all_deadlines) + 1e-6: errors.append(f"FE Route #{i+1}: Vi pham deadline hieu dung (Ve depot: {arrival_at_depot:.2f} > Deadline: {min(all_deadlines):.2f})")
     if not errors: print("\n[KIEM TRA THANH CONG] Solution appears to be feasible.")
@@ -0,0 +1,146 @@
+# --- START OF FILE test_transaction.py ---
+
+# Kiểm tra ngẫu nhiên cho nhật ký hoàn tác (ChangeContext), đánh giá chèn thuần và cache phương án chèn,
+# chạy trên bài toán sinh ngẫu nhiên (benchmark.load_problem) nên không cần file dữ liệu.
+# Cách chạy: mở terminal trong thư mục dự án và chạy lệnh: python -m unittest test_transaction.py
+
+import random
+import unittest
+
+import config
+import benchmark
+from core.transaction import ChangeContext
+from ALNS.solution_generator import create_integrated_initial_solution
+from ALNS.destroy_operators import random_removal
+import ALNS.insertion_logic as insertion_logic
+import ALNS.repair_operators as repair_operators
+
+
+def solution_fingerprint(solution):
+    """Toàn bộ trạng thái quan sát được của lời giải (tuyến, lịch trình, version, liên kết, map, hàm mục tiêu) để so sánh bằng ==."""
+    se = {id(r): (r.version, tuple(r.nodes_id), r.total_dist, r.total_travel_time, r.total_load_pickup, r.total_load_delivery,
+                  tuple(r.service_start_times), tuple(r.latest_start_times), tuple(r.load_profile), frozenset(map(id, r.serving_fe_routes)))
+          for r in solution.se_routes}
+    fe = {id(f): (f.version, tuple(f.path), f.total_dist, f.total_time, f.total_travel_time, f.route_deadline,
+                  tuple((e.activity, e.node_id, e.load_after, e.arrival_time, e.departure_time) for e in f.schedule),
+                  frozenset(map(id, f.serviced_se_routes)), tuple((k, tuple(map(id, v))) for k, v in f.se_routes_by_sat.items()),
+                  tuple(sorted(f.sat_loads.items())), f.total_load_delivery, f.total_load_pickup)
+          for f in solution.fe_routes}
+    return (se, fe, sorted(map(id, solution.se_routes)), sorted(map(id, solution.fe_routes)),
+            {cid: id(r) for cid, r in solution.customer_to_se_route_map.items()}, [c.id for c in solution.unserved_customers],
+            solution._dist_units, solution._time_units)
+
+
+class TestChangeContext(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.problem = benchmark.load_problem("synthetic:100")
+
+    def setUp(self):
+        random.seed(config.RANDOM_SEED)
+        self.solution = create_integrated_initial_solution(self.problem, verbose=False).solution
+
+    def test_rollback_restores_solution_exactly(self):
+        """
+        Nhiều lượt destroy + repair ngẫu nhiên; mỗi lượt bị rollback phải trả lời giải về đúng từng bit trạng thái
+        trước đó (kể cả version tuyến và hàm mục tiêu cộng dồn), lượt được giữ thì đóng context.
+        """
+        solution = self.solution
+        destroy_ops = list(benchmark.DESTROY_OPERATORS.values())
+        repair_ops = list(benchmark.REPAIR_OPERATORS.values())
+        for _ in range(60):
+            before = solution_fingerprint(solution)
+            context = ChangeContext(solution)
+            q = random.randint(2, max(2, len(solution.customer_to_se_route_map) // 4))
+            removed = random.choice(destroy_ops)(solution, context, q)
+            random.choice(repair_ops)(solution, context, removed)
+            if random.random() < 0.6:
+                context.rollback()
+                self.assertEqual(solution_fingerprint(solution), before)
+            else:
+                context.close()
+            self.assertIsNone(solution._journal)
+            solution.check_customer_map(); solution.check_objective()
+
+    def test_nested_savepoints(self):
+        """rollback_to_savepoint chỉ hoàn tác phần sau savepoint; rollback() của context hoàn tác tất cả."""
+        solution = self.solution
+        initial = solution_fingerprint(solution)
+        context = ChangeContext(solution)
+        removed = random_removal(solution, context, 6)
+        outer = context.savepoint()
+        after_removal = solution_fingerprint(solution)
+        repair_operators.greedy_repair(solution, context, removed[:3])
+        inner = context.savepoint()
+        after_first_repair = solution_fingerprint(solution)
+        repair_operators.greedy_repair(solution, context, removed[3:])
+        context.rollback_to_savepoint(inner)
+        self.assertEqual(solution_fingerprint(solution), after_first_repair)
+        context.rollback_to_savepoint(outer)
+        self.assertEqual(solution_fingerprint(solution), after_removal)
+        repair_operators.greedy_repair(solution, context, removed)
+        context.release_savepoint(outer)
+        context.rollback()
+        self.assertEqual(solution_fingerprint(solution), initial)
+
+
+class TestInsertionEvaluation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.problem = benchmark.load_problem("synthetic:120")
+
+    def setUp(self):
+        random.seed(config.RANDOM_SEED)
+        self.solution = create_integrated_initial_solution(self.problem, verbose=False).solution
+
+    def test_evaluator_matches_simulation(self):
+        """
+        Bật config.DEBUG_CHECK_INSERTION_EVALUATOR: mỗi đánh giá chèn thuần được đối chiếu với việc chèn thật trong
+        savepoint (báo RuntimeError nếu lệch); việc tìm phương án không được thay đổi lời giải.
+        """
+        solution = self.solution
+        insertion_processor = insertion_logic.InsertionProcessor(self.problem)
+        previous_flag = config.DEBUG_CHECK_INSERTION_EVALUATOR
+        config.DEBUG_CHECK_INSERTION_EVALUATOR = True
+        try:
+            for _ in range(4):
+                context = ChangeContext(solution)
+                removed = random_removal(solution, context, 15)
+                for customer in removed:
+                    before = solution_fingerprint(solution)
+                    insertion_logic.find_k_best_global_insertion_options(customer, solution, insertion_processor, 4)
+                    self.assertEqual(solution_fingerprint(solution), before)
+                repair_operators.greedy_repair(solution, context, removed)
+                context.close()
+        finally:
+            config.DEBUG_CHECK_INSERTION_EVALUATOR = previous_flag
+
+    def test_option_cache_matches_uncached_search(self):
+        """Trong một lần chèn regret, phương án lấy qua InsertionOptionCache phải có cùng chi phí với tìm kiếm không cache."""
+        solution = self.solution
+        original_find = repair_operators.find_k_best_global_insertion_options
+        checked = []
+        def find_and_compare(customer, solution, insertion_processor, k, cache=None):
+            options = original_find(customer, solution, insertion_processor, k, cache)
+            reference = original_find(customer, solution, insertion_processor, k)
+            self.assertEqual([round(o['objective_increase'], 9) for o in options], [round(o['objective_increase'], 9) for o in reference])
+            checked.append(customer.id)
+            return options
+        repair_operators.find_k_best_global_insertion_options = find_and_compare
+        try:
+            for _ in range(3):
+                context = ChangeContext(solution)
+                removed = random_removal(solution, context, 25)
+                repair_operators.regret_insertion(solution, context, removed)
+                context.close()
+        finally:
+            repair_operators.find_k_best_global_insertion_options = original_find
+        self.assertGreater(len(checked), 75)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# --- END OF FILE test_transaction.py ---
@@ -6,13 +6,6 @@ import os
 
 from core.data_structures import Solution, SERoute
 
-def _get_unique_nodes_from_fe_schedule(schedule: List[Dict]) -> List[int]:
-    if not schedule: return []
-    path_nodes = [schedule[0]['node_id']]
-    for event in schedule[1:]:
-        if event['node_id'] != path_nodes[-1]: path_nodes.append(event['node_id'])
-    return path_nodes
-
 # <<< THÊM THAM SỐ filename_prefix >>>
 def visualize_solution(solution: Solution, save_dir: str = None, filename_prefix: str = ""):
     problem = solution.problem
@@ -33,13 +26,13 @@ def visualize_solution(solution: Solution, save_dir: str = None, filename_prefix
         ax.text(node.x, node.y + 1, str(node.id), fontsize=9, ha='center')
     for se_route in solution.se_routes:
         color = satellite_to_color_map.get(se_route.satellite.id, 'gray')
-        path_node_ids = [nid % problem.total_nodes for nid in se_route.nodes_id]
+        path_node_ids = [problem.route_node_phys[nid] for nid in se_route.nodes_id]
         path_coords = [(problem.node_objects[nid].x, problem.node_objects[nid].y) for nid in path_node_ids]
         x_coords, y_coords = zip(*path_coords)
         ax.plot(x_coords, y_coords, color=color, linestyle='-', linewidth=1.2, alpha=0.8)
     for i, fe_route in enumerate(solution.fe_routes):
         color = fe_route_colors(i)
-        path_node_ids = _get_unique_nodes_from_fe_schedule(fe_route.schedule)
+        path_node_ids = fe_route.path
         if not path_node_ids: continue
         path_coords = [(problem.node_objects[nid].x, problem.node_objects[nid].y) for nid in path_node_ids]
         x_coords, y_coords = zip(*path_coords)